@@ -11,17 +11,32 @@ Project: AKS Jenkins Spot Workers + AI Observability
 """
 
 import os
+import re
+import heapq
+from functools import partial
+from operator import attrgetter
 import json
+import random
 import asyncio
 import aiohttp
 import requests
 import pandas as pd
 from datetime import datetime, timedelta
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, Tuple
 from dotenv import load_dotenv
-from openai import AzureOpenAI
+from openai import AsyncAzureOpenAI, APIConnectionError, APIStatusError, APITimeoutError
 import logging
 
+from http_clients import BackendConfig, HttpClientPool
+from json_stream import iter_items_async
+from log_classifier import KeywordClassifier
+from log_records import LogRecord, stream_labels
+from log_templates import LogTemplate, TemplateMiner
+from loki_shards import ShardedQueryExecutor
+from response_cache import ResponseCache, incident_fingerprint
+from prompt_builder import PromptBuilder, estimate_tokens, severity_score
+from rolling_window import RollingWindow
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -29,20 +44,119 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Log severity keywords, highest priority first
+LOG_SEVERITY_RULES = [
+    ('ERROR', ['error', 'exception', 'failed', 'crash', 'fatal']),
+    ('WARNING', ['warning', 'warn', 'deprecated']),
+    ('PERFORMANCE', ['timeout', 'slow', 'latency'])
+]
+
+LOG_SEVERITIES = [label for label, _ in LOG_SEVERITY_RULES] + ['INFO']
+
+# Loki queries for different error patterns
+LOKI_ERROR_QUERIES = [
+    # Jenkins Master Errors
+    '{kubernetes_namespace_name="jenkins-master"} |~ "(?i)(error|exception|failed|timeout)"',
+    
+    # Jenkins Workers Errors  
+    '{kubernetes_namespace_name="jenkins-workers"} |~ "(?i)(error|exception|failed|crash|killed)"',
+    
+    # Spot Workers Specific Issues
+    '{kubernetes_namespace_name="jenkins-workers"} |= "spot" |~ "(?i)(evicted|preempted|terminated)"',
+    
+    # Kubernetes System Errors
+    '{kubernetes_namespace_name=~"kube-.*"} |~ "(?i)(error|warning|failed)"',
+    
+    # Observability Stack Errors
+    '{kubernetes_namespace_name=~"(loki|prometheus|grafana).*"} |~ "(?i)(error|warning|failed)"',
+    
+    # General Warning Patterns
+    '{kubernetes_namespace_name!=""} |~ "(?i)(warning|warn|deprecated)"'
+]
+
+# The same lines as LOKI_ERROR_QUERIES split into disjoint selectors, so that summed
+# metric counts match the distinct entries: a line matched by several error queries
+# (e.g. a kube-system warning, or a spot eviction that also says "failed") counts once
+LOKI_COUNT_QUERIES = [
+    '{kubernetes_namespace_name="jenkins-master"} |~ "(?i)(error|exception|failed|timeout|warning|warn|deprecated)"',
+    '{kubernetes_namespace_name="jenkins-workers"} |~ "(?i)(error|exception|failed|crash|killed|warning|warn|deprecated)"',
+    '{kubernetes_namespace_name="jenkins-workers"} !~ "(?i)(error|exception|failed|crash|killed|warning|warn|deprecated)" '
+    '|= "spot" |~ "(?i)(evicted|preempted|terminated)"',
+    '{kubernetes_namespace_name=~"kube-.*"} |~ "(?i)(error|warning|failed|warn|deprecated)"',
+    '{kubernetes_namespace_name=~"(loki|prometheus|grafana).*"} |~ "(?i)(error|warning|failed|warn|deprecated)"',
+    '{kubernetes_namespace_name!="", '
+    'kubernetes_namespace_name!~"jenkins-master|jenkins-workers|kube-.*|(loki|prometheus|grafana).*"} '
+    '|~ "(?i)(warning|warn|deprecated)"'
+]
+
+# A fetched Loki stream: (stream labels hash, records newest first)
+LokiStream = Tuple[int, List[LogRecord]]
+
+
+def logql_severity_filters() -> Dict[str, str]:
+    """LogQL line filters reproducing the keyword classifier: a line gets the first matching rule"""
+    filters = {}
+    excluded = []
+    
+    for label, keywords in LOG_SEVERITY_RULES:
+        pattern = '(?i)(' + '|'.join(re.escape(keyword) for keyword in keywords) + ')'
+        pattern = pattern.replace('\\', '\\\\')
+        filters[label] = ' '.join(excluded + [f'|~ "{pattern}"'])
+        excluded.append(f'!~ "{pattern}"')
+    
+    filters['INFO'] = ' '.join(excluded)
+    return filters
+
+
+def count_logs_by_namespace(logs: List[LogRecord]) -> Dict[str, Dict[str, int]]:
+    """Client-side fallback: severity counts per namespace of the fetched entries"""
+    counts: Dict[str, Dict[str, int]] = {}
+    for log in logs:
+        ns_counts = counts.setdefault(log.namespace, dict.fromkeys(LOG_SEVERITIES, 0))
+        ns_counts[log.severity] += 1
+    return counts
+
+# Metric labels worth sending to the model; the rest (ids, images, hashes) is noise
+PROMPT_METRIC_LABELS = ('namespace', 'pod', 'container', 'node', 'instance', 'job',
+                        'condition', 'mountpoint', 'device')
+
+SYSTEM_PROMPT = """You are an expert Site Reliability Engineer (SRE) and Kubernetes specialist. 
+                        Analyze observability data from an AKS cluster running Jenkins with spot workers. 
+                        Provide actionable troubleshooting insights, root cause analysis, and preventive measures.
+                        Focus on Jenkins performance, spot worker reliability, and overall cluster health."""
+
 class ObservabilityAnalyzer:
     """Main class for AI-powered observability analysis"""
     
-    def __init__(self):
-        """Initialize the analyzer with configuration"""
+    def __init__(self, incremental: bool = False):
+        """Initialize the analyzer with configuration
+        
+        With incremental=True (continuous mode) logs and metric samples are kept in
+        a rolling window and each cycle only fetches what is new since the last one.
+        """
         load_dotenv()
         
-        # Azure OpenAI Configuration
-        self.openai_client = AzureOpenAI(
+        # Azure OpenAI Configuration (retries are handled in analyze_with_openai)
+        self.openai_timeout = float(os.getenv("AZURE_OPENAI_TIMEOUT_SECONDS", 60))
+        self.openai_max_retries = int(os.getenv("AZURE_OPENAI_MAX_RETRIES", 3))
+        self.openai_retry_backoff = float(os.getenv("AZURE_OPENAI_RETRY_BACKOFF_SECONDS", 2))
+        self.openai_client = AsyncAzureOpenAI(
             api_key=os.getenv("AZURE_OPENAI_API_KEY"),
             api_version=os.getenv("AZURE_OPENAI_API_VERSION", "2024-02-15-preview"),
-            azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT")
+            azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
+            timeout=self.openai_timeout,
+            max_retries=0
         )
         self.deployment_name = os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME", "gpt-4")
+        self.completion_max_tokens = int(os.getenv("AZURE_OPENAI_MAX_TOKENS", 2000))
+        
+        # Prompt size: the budget is also capped by what the model context leaves free
+        self.prompt_token_budget = min(
+            int(os.getenv("PROMPT_TOKEN_BUDGET", 4000)),
+            int(os.getenv("MODEL_CONTEXT_TOKENS", 8192)) - self.completion_max_tokens - estimate_tokens(SYSTEM_PROMPT)
+        )
+        self.last_prompt_stats: Dict[str, Any] = {}
+        self._previous_prompt_keys: set = set()
         
         # Observability Stack Configuration
         self.loki_endpoint = os.getenv("LOKI_ENDPOINT")
@@ -53,6 +167,49 @@ class ObservabilityAnalyzer:
         self.query_interval = int(os.getenv("QUERY_INTERVAL_MINUTES", 5))
         self.max_log_entries = int(os.getenv("MAX_LOG_ENTRIES", 100))
         self.analysis_hours = int(os.getenv("ANALYSIS_HISTORY_HOURS", 1))
+        self.top_templates = int(os.getenv("TOP_LOG_TEMPLATES", 10))
+        self.loki_query_concurrency = max(1, int(os.getenv("LOKI_QUERY_CONCURRENCY", 6)))
+        
+        # Each query runs as paginated time shards; MAX_LOG_ENTRIES caps its total
+        self.loki_executors = [
+            ShardedQueryExecutor(
+                partial(self._fetch_loki_page, query_id),
+                page_limit=min(int(os.getenv("LOKI_PAGE_LIMIT", 1000)), self.max_log_entries),
+                max_entries=self.max_log_entries,
+                shard_seconds=float(os.getenv("LOKI_SHARD_SECONDS", 900)),
+                max_shard_seconds=self.analysis_hours * 3600,
+                concurrency=int(os.getenv("LOKI_SHARD_CONCURRENCY", 4))
+            )
+            for query_id in range(len(LOKI_ERROR_QUERIES))
+        ]
+        self._loki_semaphore: Optional[asyncio.Semaphore] = None
+        
+        # Severity keywords compiled once, memoized across cycles
+        self.severity_classifier = KeywordClassifier(LOG_SEVERITY_RULES, default='INFO')
+        
+        # Rolling window for incremental (continuous) analysis
+        self.fetch_overlap_ns = int(os.getenv("LOKI_FETCH_OVERLAP_SECONDS", 30)) * 1_000_000_000
+        window_max_entries = int(os.getenv("LOG_WINDOW_MAX_ENTRIES", 10000))
+        self.log_window: Optional[RollingWindow] = None
+        self.metric_window: Optional[RollingWindow] = None
+        
+        if incremental:
+            self.log_window = RollingWindow(
+                timedelta(hours=self.analysis_hours),
+                window_max_entries,
+                timestamp_ns=attrgetter('timestamp_ns')
+            )
+            self.metric_window = RollingWindow(
+                timedelta(hours=self.analysis_hours),
+                window_max_entries,
+                key=lambda m: (m['metric_name'], m['timestamp'], tuple(sorted(m['labels'].items())))
+            )
+        
+        # Keep-alive connection pools, reused across analysis cycles
+        self.http = HttpClientPool([
+            BackendConfig.from_env("loki", self.loki_endpoint),
+            BackendConfig.from_env("prometheus", self.prometheus_endpoint)
+        ])
         
         # Output Configuration
         self.output_dir = os.getenv("OUTPUT_DIR", "./insights")
@@ -60,79 +217,215 @@ class ObservabilityAnalyzer:
         
         # Ensure output directory exists
         os.makedirs(self.output_dir, exist_ok=True)
+        
+        # Reuse analyses while the incident state is unchanged
+        self.response_cache: Optional[ResponseCache] = None
+        if os.getenv("AI_CACHE_ENABLED", "true").lower() == "true":
+            self.response_cache = ResponseCache(
+                os.path.join(self.output_dir, "ai_response_cache.json"),
+                ttl_seconds=int(os.getenv("AI_CACHE_TTL_SECONDS", 3600)),
+                max_entries=int(os.getenv("AI_CACHE_MAX_ENTRIES", 100))
+            )
+        self.last_cache_status: Dict[str, Any] = {}
 
-    async def query_loki_errors(self) -> List[Dict[str, Any]]:
+    async def query_loki_errors(self) -> List[LogRecord]:
         """Extract error and warning logs from Loki"""
         
         # Calculate time range for analysis
         end_time = datetime.now()
         start_time = end_time - timedelta(hours=self.analysis_hours)
         
-        # Loki queries for different error patterns
-        error_queries = [
-            # Jenkins Master Errors
-            '{kubernetes_namespace_name="jenkins-master"} |~ "(?i)(error|exception|failed|timeout)"',
-            
-            # Jenkins Workers Errors  
-            '{kubernetes_namespace_name="jenkins-workers"} |~ "(?i)(error|exception|failed|crash|killed)"',
-            
-            # Spot Workers Specific Issues
-            '{kubernetes_namespace_name="jenkins-workers"} |= "spot" |~ "(?i)(evicted|preempted|terminated)"',
-            
-            # Kubernetes System Errors
-            '{kubernetes_namespace_name=~"kube-.*"} |~ "(?i)(error|warning|failed)"',
-            
-            # Observability Stack Errors
-            '{kubernetes_namespace_name=~"(loki|prometheus|grafana).*"} |~ "(?i)(error|warning|failed)"',
+        error_queries = LOKI_ERROR_QUERIES
+        
+        start_ns = int(start_time.timestamp() * 1_000_000_000)  # nanoseconds
+        end_ns = int(end_time.timestamp() * 1_000_000_000)
+        
+        # In continuous mode each query resumes from its high-water mark
+        window = self.log_window
+        query_starts = {
+            query: window.fetch_start(query, start_ns, self.fetch_overlap_ns) if window else start_ns
+            for query in error_queries
+        }
+        
+        # Fan out all queries and their shards, bounded by the concurrency limit
+        self._loki_semaphore = asyncio.Semaphore(self.loki_query_concurrency)
+        results = await asyncio.gather(*[
+            self.loki_executors[query_id].run(query_starts[query], end_ns)
+            for query_id, query in enumerate(error_queries)
+        ])
+        
+        # One entry per line, even when several queries matched it
+        streams = [stream for query_streams in results if query_streams for stream in query_streams]
+        all_logs, duplicates = self._merge_loki_streams(streams)
+        
+        if window is None:
+            logger.info(f"Extracted {len(all_logs)} log entries from Loki ({duplicates} duplicates merged)")
+            return all_logs
+        
+        fetched = window.add(all_logs, merge=LogRecord.merge)
+        for query, query_streams in zip(error_queries, results):
+            if query_streams is not None:
+                window.advance(query, end_ns)  # Failed query: keep its mark so the gap is retried
+        
+        evicted = window.evict(end_time)
+        all_logs = window.entries(end_time)
+        
+        logger.info(f"Extracted {fetched} new log entries from Loki "
+                    f"({evicted} evicted, {len(all_logs)} in window)")
+        return all_logs
+
+    @staticmethod
+    def _merge_loki_streams(streams: List[LokiStream]) -> Tuple[List[LogRecord], int]:
+        """K-way merge of newest-first streams into one newest-first list without duplicate lines"""
+        
+        merged: List[LogRecord] = []
+        duplicates = 0
+        
+        # Duplicates share a timestamp, so only the current timestamp's keys are kept
+        current_ts = None
+        seen: Dict[Tuple[int, int], LogRecord] = {}
+        
+        ordered = heapq.merge(
+            *[((log.timestamp_ns, stream_hash, log) for log in logs) for stream_hash, logs in streams],
+            key=lambda item: item[0],
+            reverse=True
+        )
+        for ts_ns, stream_hash, log in ordered:
+            if ts_ns != current_ts:
+                current_ts = ts_ns
+                seen = {}
             
-            # General Warning Patterns
-            '{kubernetes_namespace_name!=""} |~ "(?i)(warning|warn|deprecated)"'
-        ]
+            key = (stream_hash, hash(log.log_line))
+            existing = seen.get(key)
+            if existing is None:
+                seen[key] = log
+                merged.append(log)
+            else:
+                existing.merge(log)
+                duplicates += 1
+        
+        return merged, duplicates
+
+    async def _fetch_loki_page(self, query_id: int, start_ns: int, end_ns: int,
+                               limit: int) -> Optional[List[LokiStream]]:
+        """Fetch one page of a shard over the shared session"""
+        session = await self.http.session("loki")
+        return await self._fetch_loki_query(session, self._loki_semaphore, query_id, start_ns, end_ns, limit)
+
+    async def _fetch_loki_query(self, session: aiohttp.ClientSession, semaphore: asyncio.Semaphore,
+                                query_id: int, start_ns: int, end_ns: int,
+                                limit: int) -> Optional[List[LokiStream]]:
+        """Run a single LogQL query (by index in LOKI_ERROR_QUERIES); returns its streams, or None on failure"""
+        
+        url = f"{self.loki_endpoint}/loki/api/v1/query_range"
+        params = {
+            'query': LOKI_ERROR_QUERIES[query_id],
+            'start': start_ns,
+            'end': end_ns,
+            'limit': limit,
+            'direction': 'backward'
+        }
         
-        all_logs = []
+        streams: List[LokiStream] = []
+        max_bytes = self.http.config("loki").max_response_bytes
         
-        for query in error_queries:
-            try:
-                url = f"{self.loki_endpoint}/loki/api/v1/query_range"
-                params = {
-                    'query': query,
-                    'start': int(start_time.timestamp() * 1_000_000_000),  # nanoseconds
-                    'end': int(end_time.timestamp() * 1_000_000_000),
-                    'limit': self.max_log_entries,
-                    'direction': 'backward'
-                }
-                
-                async with aiohttp.ClientSession() as session:
-                    async with session.get(url, params=params) as response:
-                        if response.status == 200:
-                            data = await response.json()
+        try:
+            async with semaphore:
+                async with session.get(url, params=params) as response:
+                    if response.status == 200:
+                        # Streams are parsed as they arrive, up to the response size cap
+                        async for stream in iter_items_async(response, 'data.result.item', max_bytes, "Loki query"):
+                            labels = stream.get('stream', {})
+                            values = stream.get('values', [])
+                            namespace, pod, container = stream_labels(
+                                labels, 'kubernetes_namespace_name', 'kubernetes_pod_name', 'kubernetes_container_name'
+                            )
+                            stream_logs = [
+                                LogRecord(int(timestamp), namespace, pod, container, log_line, query_id)
+                                for timestamp, log_line in values
+                            ]
                             
-                            if data.get('status') == 'success':
-                                results = data.get('data', {}).get('result', [])
-                                
-                                for stream in results:
-                                    labels = stream.get('stream', {})
-                                    values = stream.get('values', [])
-                                    
-                                    for timestamp, log_line in values:
-                                        all_logs.append({
-                                            'timestamp': datetime.fromtimestamp(int(timestamp) / 1_000_000_000),
-                                            'namespace': labels.get('kubernetes_namespace_name', 'unknown'),
-                                            'pod': labels.get('kubernetes_pod_name', 'unknown'),
-                                            'container': labels.get('kubernetes_container_name', 'unknown'),
-                                            'log_line': log_line,
-                                            'query_type': query,
-                                            'severity': self._classify_severity(log_line)
-                                        })
-                        else:
-                            logger.warning(f"Loki query failed with status {response.status}")
+                            # Classify each stream as soon as it is parsed
+                            severities = self.severity_classifier.classify_many([log.log_line for log in stream_logs])
+                            for log, severity in zip(stream_logs, severities):
+                                log.severity = severity
                             
-            except Exception as e:
-                logger.error(f"Error querying Loki: {e}")
-                continue
+                            # Backward queries return each stream newest first
+                            streams.append((hash(frozenset(labels.items())), stream_logs))
+                    else:
+                        logger.warning(f"Loki query failed with status {response.status}")
+                        return None
+                        
+        except Exception as e:
+            logger.error(f"Error querying Loki: {e}")
+            return None
         
-        logger.info(f"Extracted {len(all_logs)} log entries from Loki")
-        return sorted(all_logs, key=lambda x: x['timestamp'], reverse=True)
+        return streams
+
+    async def query_loki_counts(self) -> Optional[Dict[str, Dict[str, int]]]:
+        """Exact severity counts per namespace for the whole window, aggregated by Loki"""
+        
+        end_ns = int(datetime.now().timestamp() * 1_000_000_000)
+        range_seconds = self.analysis_hours * 3600
+        
+        # One metric query per (disjoint count selector, severity); the raw lines are only exemplars
+        session = await self.http.session("loki")
+        semaphore = asyncio.Semaphore(self.loki_query_concurrency)
+        jobs = [
+            (severity, f'sum by (kubernetes_namespace_name) '
+                       f'(count_over_time({query} {severity_filter} [{range_seconds}s]))')
+            for query in LOKI_COUNT_QUERIES
+            for severity, severity_filter in logql_severity_filters().items()
+        ]
+        results = await asyncio.gather(*[
+            self._fetch_loki_count(session, semaphore, count_query, end_ns)
+            for _, count_query in jobs
+        ])
+        
+        if any(result is None for result in results):
+            logger.warning("Loki count queries failed, falling back to counting fetched entries")
+            return None
+        
+        counts: Dict[str, Dict[str, int]] = {}
+        for (severity, _), by_namespace in zip(jobs, results):
+            for namespace, count in by_namespace.items():
+                ns_counts = counts.setdefault(namespace, dict.fromkeys(LOG_SEVERITIES, 0))
+                ns_counts[severity] += count
+        
+        logger.info(f"Counted {sum(sum(c.values()) for c in counts.values())} log entries server-side "
+                    f"across {len(counts)} namespaces")
+        return counts
+
+    async def _fetch_loki_count(self, session: aiohttp.ClientSession, semaphore: asyncio.Semaphore,
+                                query: str, time_ns: int) -> Optional[Dict[str, int]]:
+        """Run a LogQL instant metric query; returns count per namespace, None on failure"""
+        
+        url = f"{self.loki_endpoint}/loki/api/v1/query"
+        params = {'query': query, 'time': time_ns}
+        
+        try:
+            async with semaphore:
+                async with session.get(url, params=params) as response:
+                    if response.status != 200:
+                        logger.warning(f"Loki count query failed with status {response.status}")
+                        return None
+                    data = await response.json()
+        except Exception as e:
+            logger.error(f"Error querying Loki counts: {e}")
+            return None
+        
+        if data.get('status') != 'success':
+            return None
+        
+        return {
+            sample.get('metric', {}).get('kubernetes_namespace_name', 'unknown'): int(float(sample['value'][1]))
+            for sample in data.get('data', {}).get('result', [])
+        }
+
+    async def close(self) -> None:
+        """Release pooled HTTP connections"""
+        await self.http.close()
+        await self.openai_client.close()
 
     async def query_prometheus_metrics(self) -> List[Dict[str, Any]]:
         """Extract critical metrics from Prometheus"""
@@ -162,54 +455,56 @@ class ObservabilityAnalyzer:
         ]
         
         all_metrics = []
+        session = await self.http.session("prometheus")
         
         for metric_name, query in metric_queries:
             try:
                 url = f"{self.prometheus_endpoint}/api/v1/query"
                 params = {'query': query}
                 
-                async with aiohttp.ClientSession() as session:
-                    async with session.get(url, params=params) as response:
-                        if response.status == 200:
-                            data = await response.json()
+                async with session.get(url, params=params) as response:
+                    if response.status == 200:
+                        data = await response.json()
+                        
+                        if data.get('status') == 'success':
+                            results = data.get('data', {}).get('result', [])
                             
-                            if data.get('status') == 'success':
-                                results = data.get('data', {}).get('result', [])
+                            for result in results:
+                                metric = result.get('metric', {})
+                                value = result.get('value', [None, '0'])
                                 
-                                for result in results:
-                                    metric = result.get('metric', {})
-                                    value = result.get('value', [None, '0'])
-                                    
-                                    all_metrics.append({
-                                        'timestamp': datetime.now(),
-                                        'metric_name': metric_name,
-                                        'query': query,
-                                        'value': float(value[1]) if len(value) > 1 else 0,
-                                        'labels': metric,
-                                        'severity': self._classify_metric_severity(metric_name, float(value[1]) if len(value) > 1 else 0)
-                                    })
-                        else:
-                            logger.warning(f"Prometheus query failed with status {response.status}")
-                            
+                                all_metrics.append({
+                                    'timestamp': datetime.now(),
+                                    'metric_name': metric_name,
+                                    'query': query,
+                                    'value': float(value[1]) if len(value) > 1 else 0,
+                                    'labels': metric,
+                                    'severity': self._classify_metric_severity(metric_name, float(value[1]) if len(value) > 1 else 0)
+                                })
+                    else:
+                        logger.warning(f"Prometheus query failed with status {response.status}")
+                        
             except Exception as e:
                 logger.error(f"Error querying Prometheus: {e}")
                 continue
         
         logger.info(f"Extracted {len(all_metrics)} metrics from Prometheus")
+        
+        if self.metric_window is not None:
+            # Only the current scrape is reported: the queries return alerting series only, so a
+            # resolved alert must drop out now. The history just says since when each one alerts
+            self.metric_window.add(all_metrics)
+            self.metric_window.evict()
+            series = lambda m: (m['metric_name'], tuple(sorted(m['labels'].items())))
+            first_seen = self.metric_window.first_seen(series)
+            for metric in all_metrics:
+                metric['first_seen'] = datetime.fromtimestamp(first_seen[series(metric)] / 1_000_000_000)
+        
         return all_metrics
 
     def _classify_severity(self, log_line: str) -> str:
         """Classify log severity based on content"""
-        log_lower = log_line.lower()
-        
-        if any(keyword in log_lower for keyword in ['error', 'exception', 'failed', 'crash', 'fatal']):
-            return 'ERROR'
-        elif any(keyword in log_lower for keyword in ['warning', 'warn', 'deprecated']):
-            return 'WARNING'
-        elif any(keyword in log_lower for keyword in ['timeout', 'slow', 'latency']):
-            return 'PERFORMANCE'
-        else:
-            return 'INFO'
+        return self.severity_classifier.classify(log_line)
 
     def _classify_metric_severity(self, metric_name: str, value: float) -> str:
         """Classify metric severity based on values and thresholds"""
@@ -238,37 +533,65 @@ class ObservabilityAnalyzer:
                 
         return 'INFO'
 
-    async def analyze_with_openai(self, logs: List[Dict], metrics: List[Dict]) -> str:
+    def mine_log_templates(self, logs: List[LogRecord]) -> List[LogTemplate]:
+        """Collapse log lines into templates, most relevant first"""
+        miner = TemplateMiner(severity_order=[label for label, _ in LOG_SEVERITY_RULES] + ['INFO'])
+        miner.add_logs(logs)
+        logger.info(f"Mined {len(miner.templates)} log templates from {len(logs)} entries")
+        return miner.top(self.top_templates)
+
+    async def analyze_with_openai(self, logs: List[LogRecord], metrics: List[Dict],
+                                  templates: Optional[List[LogTemplate]] = None,
+                                  log_counts: Optional[Dict[str, Dict[str, int]]] = None) -> str:
         """Send data to Azure OpenAI for intelligent analysis"""
         
+        if templates is None:
+            templates = self.mine_log_templates(logs)
+        totals = self._severity_totals(log_counts or count_logs_by_namespace(logs))
+        
         # Prepare data summary for AI analysis
         analysis_data = {
             'timestamp': datetime.now().isoformat(),
             'summary': {
-                'total_logs': len(logs),
-                'error_logs': len([l for l in logs if l['severity'] == 'ERROR']),
-                'warning_logs': len([l for l in logs if l['severity'] == 'WARNING']),
+                'total_logs': sum(totals.values()),
+                'error_logs': totals['ERROR'],
+                'warning_logs': totals['WARNING'],
                 'total_metrics': len(metrics),
                 'critical_metrics': len([m for m in metrics if m['severity'] == 'CRITICAL']),
                 'warning_metrics': len([m for m in metrics if m['severity'] == 'WARNING'])
             },
-            'top_errors': logs[:10],  # Top 10 most recent errors
+            'top_templates': templates,  # Most severe and frequent log templates
             'critical_metrics': [m for m in metrics if m['severity'] in ['CRITICAL', 'WARNING']]
         }
         
-        # Create AI prompt for analysis
-        prompt = self._create_analysis_prompt(analysis_data)
+        # Same templates and alerts as a recent cycle: reuse that analysis
+        fingerprint = incident_fingerprint(templates, analysis_data['critical_metrics'])
+        self.last_cache_status = {'fingerprint': fingerprint, 'cached': False}
+        
+        if self.response_cache is not None:
+            cached = self.response_cache.get(fingerprint)
+            if cached is not None:
+                self.last_cache_status.update(
+                    cached=True,
+                    generated=datetime.fromtimestamp(cached['created']).isoformat(timespec='seconds')
+                )
+                # No prompt was sent this cycle: don't report the previous cycle's token stats
+                self.last_prompt_stats = {'cached': True}
+                logger.info(f"♻️ Incident state unchanged ({fingerprint[:12]}), reusing cached AI analysis")
+                return cached['response']
+        
+        # Create AI prompt for analysis within the token budget
+        built = self._build_analysis_prompt(analysis_data)
+        prompt = built.pop('prompt')
+        self.last_prompt_stats = built
         
         try:
-            response = self.openai_client.chat.completions.create(
+            response = await self._create_completion(
                 model=self.deployment_name,
                 messages=[
                     {
                         "role": "system",
-                        "content": """You are an expert Site Reliability Engineer (SRE) and Kubernetes specialist. 
-                        Analyze observability data from an AKS cluster running Jenkins with spot workers. 
-                        Provide actionable troubleshooting insights, root cause analysis, and preventive measures.
-                        Focus on Jenkins performance, spot worker reliability, and overall cluster health."""
+                        "content": SYSTEM_PROMPT
                     },
                     {
                         "role": "user", 
@@ -276,19 +599,58 @@ class ObservabilityAnalyzer:
                     }
                 ],
                 temperature=0.3,
-                max_tokens=2000
+                max_tokens=self.completion_max_tokens
             )
             
-            return response.choices[0].message.content
+            usage = getattr(response, 'usage', None)
+            if usage is not None:
+                built['actual_prompt_tokens'] = usage.prompt_tokens
+                built['completion_tokens'] = usage.completion_tokens
+            logger.info(f"Prompt tokens: estimated {built['estimated_tokens']}, "
+                        f"actual {built.get('actual_prompt_tokens', 'n/a')} "
+                        f"(budget {built['budget_tokens']}, {built['items_dropped']} items dropped)")
+            
+            analysis = response.choices[0].message.content
+            if self.response_cache is not None and analysis:
+                self.response_cache.put(fingerprint, analysis)
+            
+            return analysis
             
         except Exception as e:
             logger.error(f"Error calling Azure OpenAI: {e}")
             return f"Error generating AI insights: {e}"
 
-    def _create_analysis_prompt(self, data: Dict) -> str:
-        """Create a detailed prompt for AI analysis"""
+    async def _create_completion(self, **kwargs):
+        """Call chat completions, retrying throttling, 5xx and transport errors with backoff"""
         
-        prompt = f"""
+        for attempt in range(self.openai_max_retries + 1):
+            try:
+                return await self.openai_client.chat.completions.create(**kwargs)
+                
+            except (APIStatusError, APITimeoutError, APIConnectionError) as e:
+                status = getattr(e, 'status_code', None)
+                retryable = status is None or status == 429 or status >= 500
+                
+                if not retryable or attempt == self.openai_max_retries:
+                    raise
+                
+                # Honour Retry-After on 429s, otherwise exponential backoff with jitter
+                delay = self.openai_retry_backoff * (2 ** attempt) * (0.5 + random.random())
+                response = getattr(e, 'response', None)
+                if status == 429 and response is not None:
+                    retry_after = response.headers.get('retry-after')
+                    if retry_after and retry_after.replace('.', '', 1).isdigit():
+                        delay = float(retry_after)
+                
+                logger.warning(f"Azure OpenAI call failed ({status or type(e).__name__}), "
+                               f"retrying in {delay:.1f}s ({attempt + 1}/{self.openai_max_retries})")
+                await asyncio.sleep(delay)
+
+    def _build_analysis_prompt(self, data: Dict) -> Dict[str, Any]:
+        """Create a detailed prompt for AI analysis, ranked and trimmed to the token budget"""
+        
+        builder = PromptBuilder(self.prompt_token_budget)
+        builder.header(f"""
 OBSERVABILITY ANALYSIS REQUEST
 =============================
 
@@ -299,27 +661,35 @@ OBSERVABILITY ANALYSIS REQUEST
 - Error Logs: {data['summary']['error_logs']}
 - Warning Logs: {data['summary']['warning_logs']}
 - Critical Metrics: {data['summary']['critical_metrics']}
-
-## TOP ERROR PATTERNS
-"""
-        
-        for i, log in enumerate(data['top_errors'], 1):
-            prompt += f"""
-{i}. [{log['severity']}] {log['namespace']}/{log['pod']}
-   Time: {log['timestamp']}
-   Log: {log['log_line'][:200]}...
-"""
-        
-        prompt += "\n## CRITICAL METRICS\n"
+""")
+        builder.group('errors', "\n## TOP ERROR PATTERNS\n")
+        builder.group('metrics', "\n## CRITICAL METRICS\n")
+        
+        # Items not sent in the previous cycle rank higher
+        prompt_keys = set()
+        
+        for template in data['top_templates']:
+            key = ('template', template.template)
+            prompt_keys.add(key)
+            namespaces = ', '.join(template.namespaces)
+            builder.add('errors', f"""
+- [{template.severity}] {template.count}x in {namespaces} (pods: {', '.join(template.example_pods)})
+   Seen: {template.first_seen} -> {template.last_seen}
+   Template: {template.template[:200]}
+   Example: {template.example_line[:200]}
+""", severity_score(template.severity, key not in self._previous_prompt_keys, template.count))
         
         for metric in data['critical_metrics']:
-            prompt += f"""
+            labels = self._prompt_labels(metric['labels'])
+            key = ('metric', metric['metric_name'], labels)
+            prompt_keys.add(key)
+            builder.add('metrics', f"""
 - {metric['metric_name']}: {metric['value']:.2f} ({metric['severity']})
   Query: {metric['query']}
-  Labels: {metric['labels']}
-"""
+  Labels: {labels}
+""", severity_score(metric['severity'], key not in self._previous_prompt_keys))
         
-        prompt += """
+        builder.footer("""
 
 ## ANALYSIS REQUEST
 
@@ -334,30 +704,55 @@ Please provide:
 
 Focus on AKS Jenkins spot workers environment with Loki/Prometheus/Grafana observability stack.
 Provide kubectl commands, configuration fixes, and operational recommendations.
-"""
-        
-        return prompt
+""")
+        
+        self._previous_prompt_keys = prompt_keys
+        return builder.build()
+
+    @staticmethod
+    def _prompt_labels(labels: Dict[str, str]) -> str:
+        """Compact label rendering limited to the keys useful for diagnosis"""
+        return ', '.join(f"{key}={labels[key]}" for key in PROMPT_METRIC_LABELS if key in labels)
+
+    @staticmethod
+    def _severity_totals(log_counts: Dict[str, Dict[str, int]]) -> Dict[str, int]:
+        """Per-severity totals over all namespaces"""
+        return {
+            severity: sum(ns_counts[severity] for ns_counts in log_counts.values())
+            for severity in LOG_SEVERITIES
+        }
 
-    async def generate_insights_report(self, ai_analysis: str, logs: List[Dict], metrics: List[Dict]) -> str:
+    async def generate_insights_report(self, ai_analysis: str, logs: List[LogRecord], metrics: List[Dict],
+                                       templates: Optional[List[LogTemplate]] = None,
+                                       log_counts: Optional[Dict[str, Dict[str, int]]] = None) -> str:
         """Generate a comprehensive markdown report"""
         
         timestamp = datetime.now()
+        if templates is None:
+            templates = self.mine_log_templates(logs)
+        
+        # Exact counts from Loki when available, otherwise from the fetched entries
+        counts_source = "Loki metric queries over the full window"
+        if log_counts is None:
+            log_counts = count_logs_by_namespace(logs)
+            counts_source = f"the {len(logs)} fetched log entries (capped by MAX_LOG_ENTRIES per query)"
+        totals = self._severity_totals(log_counts)
         
         report = f"""# 🤖 AI-Powered Observability Insights
 
 **Generated:** {timestamp.strftime('%Y-%m-%d %H:%M:%S')}  
 **Analysis Period:** Last {self.analysis_hours} hour(s)  
 **Cluster:** AKS Jenkins Spot Workers  
-
+{self._cache_note()}
 ---
 
 ## 📊 EXECUTIVE SUMMARY
 
 | Metric | Count | Severity |
 |--------|-------|----------|
-| Total Log Entries | {len(logs)} | - |
-| Error Logs | {len([l for l in logs if l['severity'] == 'ERROR'])} | 🔴 |
-| Warning Logs | {len([l for l in logs if l['severity'] == 'WARNING'])} | 🟡 |
+| Total Log Entries | {sum(totals.values())} | - |
+| Error Logs | {totals['ERROR']} | 🔴 |
+| Warning Logs | {totals['WARNING']} | 🟡 |
 | Critical Metrics | {len([m for m in metrics if m['severity'] == 'CRITICAL'])} | 🔴 |
 | Warning Metrics | {len([m for m in metrics if m['severity'] == 'WARNING'])} | 🟡 |
 
@@ -374,15 +769,10 @@ Provide kubectl commands, configuration fixes, and operational recommendations.
 ### Error Patterns by Namespace
 """
         
-        # Group logs by namespace and severity
-        namespace_errors = {}
-        for log in logs:
-            ns = log['namespace']
-            severity = log['severity']
-            
-            if ns not in namespace_errors:
-                namespace_errors[ns] = {'ERROR': 0, 'WARNING': 0, 'PERFORMANCE': 0, 'INFO': 0}
-            namespace_errors[ns][severity] += 1
+        report += f"\n_Log counts from {counts_source}._\n"
+        
+        # Namespaces with the most errors first
+        namespace_errors = dict(sorted(log_counts.items(), key=lambda item: (-item[1]['ERROR'], item[0])))
         
         for namespace, counts in namespace_errors.items():
             report += f"""
@@ -393,14 +783,13 @@ Provide kubectl commands, configuration fixes, and operational recommendations.
 - Info: {counts['INFO']} ℹ️
 """
         
-        report += "\n### Recent Critical Logs\n"
+        report += "\n### Top Log Templates\n"
         
-        critical_logs = [l for l in logs if l['severity'] == 'ERROR'][:10]
-        for log in critical_logs:
+        for template in templates:
             report += f"""
-**{log['timestamp'].strftime('%H:%M:%S')}** - `{log['namespace']}/{log['pod']}`  
+**{template.severity}** - {template.count}x between {template.first_seen.strftime('%H:%M:%S')} and {template.last_seen.strftime('%H:%M:%S')} - `{', '.join(template.example_pods)}`  
 ```
-{log['log_line'][:300]}
+{template.template[:300]}
 ```
 """
         
@@ -415,6 +804,8 @@ Provide kubectl commands, configuration fixes, and operational recommendations.
 Query: `{metric['query']}`  
 Labels: {metric['labels']}  
 """
+                if 'first_seen' in metric and metric['first_seen'] < metric['timestamp']:
+                    report += f"Alerting since: {metric['first_seen'].strftime('%Y-%m-%d %H:%M:%S')}  \n"
         else:
             report += "\n✅ **No critical metrics detected**\n"
         
@@ -481,26 +872,46 @@ This report was generated automatically. Next analysis scheduled in {self.query_
         
         return report
 
+    def _cache_note(self) -> str:
+        """Report line telling whether the AI analysis came from the cache"""
+        if not self.last_cache_status.get('cached'):
+            return ''
+        return (f"**AI Analysis:** ♻️ Reused from cache (generated {self.last_cache_status['generated']}, "
+                f"incident fingerprint `{self.last_cache_status['fingerprint'][:12]}`)  \n")
+
+    async def collect_data(self) -> Tuple[List[LogRecord], List[Dict], Optional[Dict[str, Dict[str, int]]]]:
+        """Extract logs, log counts and metrics from the observability stack"""
+        logger.info("📊 Extracting logs from Loki...")
+        logs, log_counts = await asyncio.gather(self.query_loki_errors(), self.query_loki_counts())
+        
+        logger.info("📈 Extracting metrics from Prometheus...")
+        metrics = await self.query_prometheus_metrics()
+        
+        return logs, metrics, log_counts
+
     async def run_analysis(self) -> None:
         """Main analysis workflow"""
         logger.info("🚀 Starting AI-Powered Observability Analysis")
         
+        logs, metrics, log_counts = await self.collect_data()
+        await self.analyze_and_report(logs, metrics, log_counts)
+
+    async def analyze_and_report(self, logs: List[LogRecord], metrics: List[Dict],
+                                 log_counts: Optional[Dict[str, Dict[str, int]]] = None) -> None:
+        """Generate AI insights for collected data and write the reports"""
+        
         try:
-            # Extract data from observability stack
-            logger.info("📊 Extracting logs from Loki...")
-            logs = await self.query_loki_errors()
-            
-            logger.info("📈 Extracting metrics from Prometheus...")
-            metrics = await self.query_prometheus_metrics()
+            # Collapse repetitive lines before building the prompt and report
+            templates = self.mine_log_templates(logs)
             
             # Generate AI insights
             logger.info("🧠 Generating AI insights with Azure OpenAI...")
-            ai_analysis = await self.analyze_with_openai(logs, metrics)
+            ai_analysis = await self.analyze_with_openai(logs, metrics, templates, log_counts)
             
             # Generate comprehensive report
             if self.generate_markdown:
                 logger.info("📝 Generating insights report...")
-                report = await self.generate_insights_report(ai_analysis, logs, metrics)
+                report = await self.generate_insights_report(ai_analysis, logs, metrics, templates, log_counts)
                 
                 # Save report
                 timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
@@ -522,9 +933,13 @@ This report was generated automatically. Next analysis scheduled in {self.query_
             data_file = f"{self.output_dir}/raw_data_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
             with open(data_file, 'w', encoding='utf-8') as f:
                 json.dump({
-                    'logs': logs,
+                    'logs': [log.to_dict(LOKI_ERROR_QUERIES) for log in logs],
+                    'log_counts': log_counts,
+                    'log_templates': [template.to_dict() for template in templates],
                     'metrics': metrics,
-                    'ai_analysis': ai_analysis
+                    'ai_analysis': ai_analysis,
+                    'prompt_stats': self.last_prompt_stats,
+                    'ai_cache': self.last_cache_status
                 }, f, indent=2, default=str)
             
             logger.info("🎉 Analysis completed successfully!")
@@ -537,7 +952,10 @@ This report was generated automatically. Next analysis scheduled in {self.query_
 async def main():
     """Main entry point"""
     analyzer = ObservabilityAnalyzer()
-    await analyzer.run_analysis()
+    try:
+        await analyzer.run_analysis()
+    finally:
+        await analyzer.close()
 
 
 if __name__ == "__main__":
@@ -12,6 +12,7 @@ import logging
 import signal
 import sys
 from datetime import datetime
+from typing import Optional
 from ai_observability_analyzer import ObservabilityAnalyzer
 
 logger = logging.getLogger(__name__)
@@ -21,7 +22,7 @@ class ContinuousMonitor:
     
     def __init__(self, interval_minutes: int = 5):
         self.interval_minutes = interval_minutes
-        self.analyzer = ObservabilityAnalyzer()
+        self.analyzer = ObservabilityAnalyzer(incremental=True)
         self.running = True
         
         # Setup signal handlers for graceful shutdown
@@ -34,18 +35,34 @@ class ContinuousMonitor:
         self.running = False
     
     async def run(self):
-        """Main monitoring loop"""
+        """Main monitoring loop
+        
+        The AI analysis and report of one cycle run in the background, so the
+        next cycle's data collection overlaps with a slow Azure OpenAI call.
+        """
         logger.info(f"🔄 Starting continuous monitoring (interval: {self.interval_minutes} minutes)")
         
         iteration = 0
+        pending: Optional[asyncio.Task] = None
         
         while self.running:
             try:
                 iteration += 1
                 logger.info(f"🔍 Analysis iteration #{iteration} - {datetime.now()}")
                 
-                # Run analysis
-                await self.analyzer.run_analysis()
+                # Collect data while the previous cycle's analysis may still be running
+                logs, metrics, log_counts = await self.analyzer.collect_data()
+                
+                # Reports are written in order: finish the previous cycle first
+                if pending is not None:
+                    previous, pending = pending, None
+                    try:
+                        await previous
+                    except Exception as e:
+                        # Its failure must not discard the data just collected
+                        logger.error(f"❌ Error in previous cycle's analysis: {e}")
+
+                pending = asyncio.create_task(self.analyzer.analyze_and_report(logs, metrics, log_counts))
                 
                 # Wait for next interval
                 if self.running:
@@ -62,6 +79,13 @@ class ContinuousMonitor:
                 if self.running:
                     await asyncio.sleep(self.interval_minutes * 60)
         
+        if pending is not None:
+            try:
+                await pending
+            except Exception as e:
+                logger.error(f"❌ Error in final analysis: {e}")
+        
+        await self.analyzer.close()
         logger.info("✅ Monitoring stopped")
 
 async def main():
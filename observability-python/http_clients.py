@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Pooled HTTP Clients for the Observability Stack
+===============================================
+
+Long-lived HTTP sessions for Loki, Prometheus and Tempo. Each backend gets
+its own keep-alive connection pool, connection limit and explicit
+connect/read timeouts, so repeated analysis cycles reuse connections
+instead of paying a new handshake per query.
+
+The AI analyzer and the Jenkins trace analyzer draw their aiohttp sessions
+from the same HttpClientPool.
+"""
+
+import os
+from dataclasses import dataclass
+from typing import Dict, Iterable, Optional
+
+import aiohttp
+
+
+@dataclass(frozen=True)
+class BackendConfig:
+    """Connection settings for a single backend"""
+    name: str
+    base_url: str
+    max_connections: int = 10
+    connect_timeout: float = 5.0
+    read_timeout: float = 30.0
+    keepalive_timeout: float = 60.0
+    dns_cache_ttl: int = 300
+    max_response_bytes: int = 64 * 1024 * 1024
+
+    @classmethod
+    def from_env(cls, name: str, base_url: Optional[str], **defaults) -> "BackendConfig":
+        """Build a config, letting <NAME>_MAX_CONNECTIONS etc. override the defaults"""
+        prefix = name.upper()
+        base = cls(name=name, base_url=(base_url or '').rstrip('/'), **defaults)
+
+        return cls(
+            name=name,
+            base_url=base.base_url,
+            max_connections=int(os.getenv(f"{prefix}_MAX_CONNECTIONS", base.max_connections)),
+            connect_timeout=float(os.getenv(f"{prefix}_CONNECT_TIMEOUT", base.connect_timeout)),
+            read_timeout=float(os.getenv(f"{prefix}_READ_TIMEOUT", base.read_timeout)),
+            keepalive_timeout=float(os.getenv("HTTP_KEEPALIVE_TIMEOUT", base.keepalive_timeout)),
+            dns_cache_ttl=int(os.getenv("HTTP_DNS_CACHE_TTL", base.dns_cache_ttl)),
+            max_response_bytes=int(float(os.getenv(f"{prefix}_MAX_RESPONSE_MB",
+                                                   base.max_response_bytes / (1024 * 1024))) * 1024 * 1024)
+        )
+
+    def url(self, path: str) -> str:
+        """Absolute URL for a path on this backend"""
+        return f"{self.base_url}/{path.lstrip('/')}"
+
+
+class HttpClientPool:
+    """Per-backend keep-alive sessions that live as long as the analyzer"""
+
+    def __init__(self, backends: Iterable[BackendConfig] = ()):
+        self.backends: Dict[str, BackendConfig] = {}
+        self._async_sessions: Dict[str, aiohttp.ClientSession] = {}
+
+        for backend in backends:
+            self.register(backend)
+
+    def register(self, backend: BackendConfig) -> None:
+        """Add or replace a backend configuration"""
+        self.backends[backend.name] = backend
+
+    def config(self, name: str) -> BackendConfig:
+        """Return the configuration of a registered backend"""
+        try:
+            return self.backends[name]
+        except KeyError:
+            raise KeyError(f"Unknown backend '{name}'") from None
+
+    async def session(self, name: str) -> aiohttp.ClientSession:
+        """Return the pooled aiohttp session for a backend, creating it on first use"""
+        session = self._async_sessions.get(name)
+
+        if session is None or session.closed:
+            backend = self.config(name)
+            connector = aiohttp.TCPConnector(
+                limit=backend.max_connections,
+                ttl_dns_cache=backend.dns_cache_ttl,
+                keepalive_timeout=backend.keepalive_timeout
+            )
+            timeout = aiohttp.ClientTimeout(
+                total=None,
+                sock_connect=backend.connect_timeout,
+                sock_read=backend.read_timeout
+            )
+            session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+            self._async_sessions[name] = session
+
+        return session
+
+    async def close(self) -> None:
+        """Close every pooled session"""
+        for session in self._async_sessions.values():
+            if not session.closed:
+                await session.close()
+        self._async_sessions.clear()
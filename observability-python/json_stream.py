@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Streaming JSON Responses
+========================
+
+Incremental parsing of large Loki and Tempo responses. Instead of loading a
+whole query_range or trace body with response.json(), the items under a
+prefix (e.g. every stream in data.result) are yielded as the body arrives,
+so the caller can process and drop them one at a time.
+
+Every response is read through a byte cap. When a body grows past it the
+parse stops with a warning and the caller keeps whatever was yielded so far,
+instead of the monitor being OOM-killed.
+
+Optional dependencies:
+- ijson: incremental parser (uses its C backend when available). Without it
+  the capped body is read fully and parsed in one go.
+- orjson: faster whole-body parsing for the fallback path.
+"""
+
+import json
+import logging
+from typing import Any, AsyncIterator, Callable, Iterator, Optional
+
+try:
+    import ijson
+except ImportError:  # Optional: fall back to whole-body parsing
+    ijson = None
+
+try:
+    import orjson
+except ImportError:  # Optional: fall back to the standard library
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+
+# Exceptions raised for malformed or cut-off bodies, whichever parser is in use
+JSON_ERRORS = (ValueError,) + ((ijson.JSONError,) if ijson is not None else ())
+
+
+class ResponseTooLarge(Exception):
+    """The response body exceeded the configured byte cap"""
+
+
+def loads(data: bytes) -> Any:
+    """Parse a complete JSON document with the fastest available backend"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _select(document: Any, prefix: str) -> Iterator[Any]:
+    """Items under an ijson-style prefix ('data.result.item') of a parsed document"""
+    node = document
+    for part in prefix.split('.'):
+        if part == 'item':
+            break
+        node = node.get(part, {}) if isinstance(node, dict) else {}
+    if isinstance(node, list):
+        yield from node
+
+
+class _CappedAsyncReader:
+    """aiohttp StreamReader wrapper that raises once max_bytes have been read"""
+
+    def __init__(self, content, max_bytes: int):
+        self.content = content
+        self.max_bytes = max_bytes
+        self.total = 0
+
+    async def read(self, size: int = CHUNK_SIZE) -> bytes:
+        if size == 0:
+            return b''  # ijson probes the stream type with read(0)
+        data = await self.content.read(size if size > 0 else CHUNK_SIZE)
+        self.total += len(data)
+        if self.total > self.max_bytes:
+            raise ResponseTooLarge(self.total)
+        return data
+
+
+def _warn_truncated(source: str, max_bytes: int, items: int) -> None:
+    logger.warning(f"{source}: response exceeded {max_bytes / (1024 * 1024):g} MB, "
+                   f"truncated after {items} items")
+
+
+async def iter_items_async(response, prefix: str, max_bytes: int, source: str = "response",
+                           on_truncated: Optional[Callable[[], None]] = None) -> AsyncIterator[Any]:
+    """Yield the items under prefix from an aiohttp response, reading at most max_bytes"""
+    reader = _CappedAsyncReader(response.content, max_bytes)
+    count = 0
+
+    try:
+        if ijson is not None:
+            async for item in ijson.items(reader, prefix, use_float=True):
+                count += 1
+                yield item
+            return
+
+        chunks = []
+        while True:
+            chunk = await reader.read()
+            if not chunk:
+                break
+            chunks.append(chunk)
+        for item in _select(loads(b''.join(chunks)), prefix):
+            count += 1
+            yield item
+
+    except ResponseTooLarge:
+        _warn_truncated(source, max_bytes, count)
+        if on_truncated is not None:
+            on_truncated()
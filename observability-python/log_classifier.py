@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Compiled Keyword Classifier
+===========================
+
+Shared engine for the keyword scans used to label log lines (severity in
+the AI analyzer, error/warning detection in the Jenkins trace analyzers).
+
+All keywords of a rule set are compiled once into a single trie-shaped regex,
+so a line is scanned in one pass instead of one `keyword in line` test per
+keyword. Results are identical to the case-insensitive substring checks they
+replace:
+
+- a keyword that contains other keywords also carries their labels
+- when a keyword can start inside another one and add labels (a suffix of
+  one is a prefix of the other) the joined string is compiled in as well,
+  so the non-overlapping scan never loses a label
+
+Lines are memoized, so repeated lines in a warning storm are scanned once.
+"""
+
+import re
+from typing import Dict, FrozenSet, Iterable, List, Sequence, Set, Tuple
+
+
+class KeywordClassifier:
+    """Ordered (label, keywords) rules compiled into a single regex"""
+
+    def __init__(self, rules: Sequence[Tuple[str, Iterable[str]]],
+                 default: str = 'INFO', cache_size: int = 100_000):
+        self.default = default
+        self.cache_size = cache_size
+        self.labels_in_order: List[str] = [label for label, _ in rules]
+
+        # Rule priority: earlier rules win in classify()
+        priority = {label: i for i, label in enumerate(self.labels_in_order)}
+
+        keyword_labels: Dict[str, Set[str]] = {}
+        for label, keywords in rules:
+            for keyword in keywords:
+                keyword = keyword.lower()
+                if not keyword:
+                    raise ValueError(f"Empty keyword in rule '{label}'")
+                keyword_labels.setdefault(keyword, set()).add(label)
+
+        self._labels_for = self._compile_terms(keyword_labels)
+        self._priority_for: Dict[str, int] = {
+            term: min(priority[label] for label in labels)
+            for term, labels in self._labels_for.items()
+        }
+        self._findall = re.compile(self._trie_regex(self._labels_for)).findall
+
+        self._label_cache: Dict[str, str] = {}
+        self._labels_cache: Dict[str, FrozenSet[str]] = {}
+
+    @staticmethod
+    def _compile_terms(keyword_labels: Dict[str, Set[str]]) -> Dict[str, FrozenSet[str]]:
+        """Search terms and the labels each one implies"""
+
+        def implied(term: str) -> FrozenSet[str]:
+            return frozenset(
+                label
+                for keyword, labels in keyword_labels.items() if keyword in term
+                for label in labels
+            )
+
+        terms = {keyword: implied(keyword) for keyword in keyword_labels}
+
+        # Join overlapping keywords until no overlap adds a label; the label set
+        # grows with every join, so this terminates
+        pending = list(terms)
+        while pending:
+            first = pending.pop()
+            for cut in range(1, len(first)):
+                suffix = first[cut:]
+                for second in keyword_labels:
+                    if len(suffix) < len(second) and second.startswith(suffix):
+                        joined = first[:cut] + second
+                        if joined not in terms and not implied(second) <= terms[first]:
+                            terms[joined] = implied(joined)
+                            pending.append(joined)
+
+        return terms
+
+    @staticmethod
+    def _trie_regex(terms: Iterable[str]) -> str:
+        """Alternation sharing common prefixes; greedy, so the longest term wins"""
+        trie: Dict = {}
+        for term in terms:
+            node = trie
+            for char in term:
+                node = node.setdefault(char, {})
+            node[''] = {}
+
+        def build(node: Dict) -> str:
+            branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+            if not branches:
+                return ''
+            body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+            return f'(?:{body})?' if '' in node else body
+
+        return build(trie)
+
+    def reset(self) -> None:
+        """Forget memoized lines"""
+        self._label_cache.clear()
+        self._labels_cache.clear()
+
+    def _remember(self, cache: Dict, line: str, value) -> None:
+        if len(cache) >= self.cache_size:
+            cache.clear()
+        cache[line] = value
+
+    def _scan(self, line: str) -> str:
+        found = self._findall(line.lower())
+        if not found:
+            return self.default
+        return self.labels_in_order[min(map(self._priority_for.__getitem__, found))]
+
+    def classify(self, line: str) -> str:
+        """Label of the highest-priority rule with a keyword in the line"""
+        label = self._label_cache.get(line)
+        if label is None:
+            label = self._scan(line)
+            self._remember(self._label_cache, line, label)
+        return label
+
+    def labels(self, line: str) -> FrozenSet[str]:
+        """Every rule label with a keyword in the line"""
+        labels = self._labels_cache.get(line)
+        if labels is None:
+            labels = frozenset().union(*map(self._labels_for.__getitem__, self._findall(line.lower())))
+            self._remember(self._labels_cache, line, labels)
+        return labels
+
+    def has(self, line: str, label: str) -> bool:
+        """True if the line contains a keyword of the given rule"""
+        return label in self.labels(line)
+
+    def classify_many(self, lines: Sequence[str]) -> List[str]:
+        """Label a whole batch of lines (e.g. a Loki response), scanning each distinct line once"""
+        cache = self._label_cache
+        pending = [line for line in dict.fromkeys(lines) if line not in cache]
+
+        if len(cache) + len(pending) > self.cache_size:
+            cache.clear()
+
+        for line, label in zip(pending, map(self._scan, pending)):
+            cache[line] = label
+
+        return [cache[line] if line in cache else self.classify(line) for line in lines]
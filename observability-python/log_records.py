@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Compact Log Records
+===================
+
+Slotted representation of Loki log entries for large fetches. Compared to a
+dict per line, a record has no per-instance __dict__, shares its interned
+stream labels with every line of the same stream, keeps the timestamp as
+integer nanoseconds and stores the matching queries as a bit mask of small
+integer ids. Datetimes and query strings are only materialized when the
+record is rendered.
+"""
+
+import sys
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+UNKNOWN = sys.intern('unknown')
+
+
+def stream_labels(labels: Dict[str, str], *keys: str) -> Tuple[str, ...]:
+    """Interned values of the given stream labels, shared by all lines of the stream"""
+    return tuple(sys.intern(labels[key]) if key in labels else UNKNOWN for key in keys)
+
+
+class LogRecord:
+    """One Loki log line"""
+
+    __slots__ = ('timestamp_ns', 'namespace', 'pod', 'container', 'node', 'log_line', 'query_mask', 'severity')
+
+    def __init__(self, timestamp_ns: int, namespace: str, pod: str, container: str, log_line: str,
+                 query_id: int = 0, node: str = UNKNOWN, severity: Optional[str] = None):
+        self.timestamp_ns = timestamp_ns
+        self.namespace = namespace
+        self.pod = pod
+        self.container = container
+        self.node = node
+        self.log_line = log_line
+        self.query_mask = 1 << query_id
+        self.severity = severity
+
+    def __repr__(self) -> str:
+        return f"LogRecord({self.timestamp_ns}, {self.namespace}/{self.pod}, {self.log_line[:60]!r})"
+
+    @property
+    def timestamp(self) -> datetime:
+        return datetime.fromtimestamp(self.timestamp_ns / 1_000_000_000)
+
+    @property
+    def query_ids(self) -> List[int]:
+        """Ids of every query that returned this line, lowest first"""
+        return [i for i in range(self.query_mask.bit_length()) if self.query_mask >> i & 1]
+
+    @property
+    def query_id(self) -> int:
+        """Id of the first query that returned this line"""
+        return (self.query_mask & -self.query_mask).bit_length() - 1
+
+    def merge(self, other: 'LogRecord') -> None:
+        """Record the queries of a duplicate of this line"""
+        self.query_mask |= other.query_mask
+
+    def to_dict(self, queries: Sequence[str]) -> Dict[str, Any]:
+        """Render as the dict layout used by reports and raw data dumps"""
+        return {
+            'timestamp': self.timestamp,
+            'namespace': self.namespace,
+            'pod': self.pod,
+            'container': self.container,
+            'log_line': self.log_line,
+            'severity': self.severity,
+            'query_type': queries[self.query_id],
+            'query_types': [queries[i] for i in self.query_ids]
+        }
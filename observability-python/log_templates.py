@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Log Template Mining
+===================
+
+Streaming, Drain-style clustering of log lines into templates. Variable
+parts (numbers, IDs, addresses, timestamps) are masked, lines are routed
+through a fixed-depth prefix tree and merged into the most similar template
+of their leaf, with differing tokens replaced by a wildcard.
+
+Ten copies of the same stack trace become one template with a count, so the
+AI prompt and the markdown report can cover more distinct problems in fewer
+tokens.
+"""
+
+import re
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+WILDCARD = '<*>'
+
+# Variable parts masked before tokenizing, most specific first
+MASKS = [
+    re.compile(r'\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2}(?:[.,]\d+)?(?:Z|[+-]\d{2}:?\d{2})?'),
+    re.compile(r'\b[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}\b'),
+    re.compile(r'\b\d{1,3}(?:\.\d{1,3}){3}(?::\d+)?\b'),
+    re.compile(r'\b0x[0-9a-fA-F]+\b|\b[0-9a-fA-F]{16,}\b'),
+    re.compile(r'(?<![\w.-])\d+(?:\.\d+)?(?:ms|s|m|h|b|kb|mb|gb|ki|mi|gi|%)?(?![\w.-])', re.IGNORECASE)
+]
+
+DEFAULT_SEVERITY_ORDER = ('ERROR', 'WARNING', 'PERFORMANCE', 'INFO')
+
+
+@dataclass
+class LogTemplate:
+    """A cluster of similar log lines"""
+    template_id: int
+    tokens: List[str]
+    severity: str
+    first_seen: datetime
+    last_seen: datetime
+    example_line: str
+    count: int = 0
+    namespaces: Dict[str, int] = field(default_factory=dict)
+    example_pods: List[str] = field(default_factory=list)
+
+    @property
+    def template(self) -> str:
+        return ' '.join(self.tokens)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'template_id': self.template_id,
+            'template': self.template,
+            'severity': self.severity,
+            'count': self.count,
+            'first_seen': self.first_seen,
+            'last_seen': self.last_seen,
+            'namespaces': self.namespaces,
+            'example_pods': self.example_pods,
+            'example_line': self.example_line
+        }
+
+
+class TemplateMiner:
+    """Drain-style streaming log template miner"""
+
+    def __init__(self, depth: int = 4, similarity: float = 0.5, max_children: int = 100,
+                 max_examples: int = 3, severity_order: Sequence[str] = DEFAULT_SEVERITY_ORDER):
+        self.depth = max(depth, 3)
+        self.similarity = similarity
+        self.max_children = max_children
+        self.max_examples = max_examples
+        self.severity_rank = {severity: i for i, severity in enumerate(severity_order)}
+
+        self.templates: List[LogTemplate] = []
+        self._tree: Dict[Any, Any] = {}
+
+    @staticmethod
+    def tokenize(line: str) -> List[str]:
+        """Mask variable parts and split into tokens"""
+        for mask in MASKS:
+            line = mask.sub(WILDCARD, line)
+        return line.split()
+
+    def _leaf(self, tokens: List[str]) -> List[LogTemplate]:
+        """Route tokens through the prefix tree: length first, then leading tokens"""
+        node = self._tree.setdefault(len(tokens), {})
+
+        for token in tokens[:self.depth - 2]:
+            key = WILDCARD if any(char.isdigit() for char in token) else token
+            if key not in node and len(node) >= self.max_children:
+                key = WILDCARD
+            node = node.setdefault(key, {})
+
+        return node.setdefault(None, [])
+
+    @staticmethod
+    def _score(template: LogTemplate, tokens: List[str]) -> Tuple[float, int]:
+        """(share of identical tokens, number of wildcards) of a candidate template"""
+        same = wildcards = 0
+        for expected, token in zip(template.tokens, tokens):
+            if expected == WILDCARD:
+                wildcards += 1
+            elif expected == token:
+                same += 1
+        return same / len(tokens) if tokens else 1.0, wildcards
+
+    def add(self, line: str, timestamp: Optional[datetime] = None, pod: str = 'unknown',
+            namespace: str = 'unknown', severity: str = 'INFO') -> LogTemplate:
+        """Assign a line to a template, creating or generalizing one as needed"""
+        timestamp = timestamp or datetime.now()
+        tokens = self.tokenize(line)
+        leaf = self._leaf(tokens)
+
+        best, best_score = None, (-1.0, -1)
+        for candidate in leaf:
+            score = self._score(candidate, tokens)
+            if score > best_score:
+                best, best_score = candidate, score
+
+        if best is None or best_score[0] < self.similarity:
+            best = LogTemplate(
+                template_id=len(self.templates) + 1,
+                tokens=tokens,
+                severity=severity,
+                first_seen=timestamp,
+                last_seen=timestamp,
+                example_line=line
+            )
+            leaf.append(best)
+            self.templates.append(best)
+        else:
+            best.tokens = [
+                expected if expected == token else WILDCARD
+                for expected, token in zip(best.tokens, tokens)
+            ]
+
+        best.count += 1
+        best.first_seen = min(best.first_seen, timestamp)
+        best.last_seen = max(best.last_seen, timestamp)
+        best.namespaces[namespace] = best.namespaces.get(namespace, 0) + 1
+
+        if self._rank(severity) < self._rank(best.severity):
+            best.severity = severity
+            best.example_line = line
+        if pod not in best.example_pods and len(best.example_pods) < self.max_examples:
+            best.example_pods.append(pod)
+
+        return best
+
+    def add_logs(self, logs: Sequence[Any]) -> None:
+        """Feed analyzer log records into the miner"""
+        for log in logs:
+            self.add(log.log_line, log.timestamp, log.pod, log.namespace, log.severity)
+
+    def _rank(self, severity: str) -> int:
+        return self.severity_rank.get(severity, len(self.severity_rank))
+
+    def top(self, n: int) -> List[LogTemplate]:
+        """Most relevant templates: worst severity first, then most frequent, then most recent"""
+        return sorted(
+            self.templates,
+            key=lambda t: (self._rank(t.severity), -t.count, -t.last_seen.timestamp())
+        )[:n]
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Sharded Loki Queries
+====================
+
+Client-side time sharding for Loki query_range. A single request over the
+whole analysis window silently drops everything past its `limit` and cannot
+use Loki's parallelism. The executor here splits the range into shards,
+runs them concurrently (newest first), follows each shard's pagination
+cursor until it is exhausted, and stops once a global cap of entries is
+reached.
+
+Shard size adapts to the volume seen so far, aiming at roughly one page per
+shard, and is remembered between runs of the same query. Each wave only starts
+as many shards as the remaining cap needs at that size (a single probe shard
+while the density is unknown), so shards that would be trimmed away are never
+downloaded. A budget that fits in one page is fetched as a single request.
+
+Pages are returned as lists of (stream key, entries newest first); callers
+merge them back into one ordered list (pages of the same stream simply show
+up as separate streams).
+"""
+
+import asyncio
+import heapq
+import logging
+from operator import attrgetter
+from typing import Any, Awaitable, Callable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+NS_PER_SECOND = 1_000_000_000
+
+# (stream key, entries newest first)
+Stream = Tuple[Any, List[Any]]
+PageFetcher = Callable[[int, int, int], Awaitable[Optional[List[Stream]]]]
+
+
+class ShardedQueryExecutor:
+    """Runs one LogQL query as concurrent, paginated time shards"""
+
+    def __init__(self, fetch_page: PageFetcher, page_limit: int = 1000, max_entries: int = 5000,
+                 shard_seconds: float = 900, min_shard_seconds: float = 60,
+                 max_shard_seconds: float = 6 * 3600, concurrency: int = 4,
+                 timestamp_ns: Callable[[Any], int] = attrgetter('timestamp_ns')):
+        self.fetch_page = fetch_page
+        self.page_limit = page_limit
+        self.max_entries = max_entries
+        self.min_shard_ns = int(min_shard_seconds * NS_PER_SECOND)
+        self.max_shard_ns = int(max_shard_seconds * NS_PER_SECOND)
+        self.shard_ns = self._clamp(int(shard_seconds * NS_PER_SECOND))
+        self.concurrency = max(concurrency, 1)
+        self.timestamp_ns = timestamp_ns
+        # Whether shard_ns has been sized from observed volume yet
+        self.calibrated = False
+
+    def _clamp(self, shard_ns: int) -> int:
+        return max(self.min_shard_ns, min(self.max_shard_ns, shard_ns))
+
+    async def run(self, start_ns: int, end_ns: int) -> Optional[List[Stream]]:
+        """All streams in [start_ns, end_ns), newest shards first; None if any page failed"""
+        streams: List[Stream] = []
+        total = 0
+        cursor = end_ns
+
+        while cursor > start_ns and total < self.max_entries:
+            # A wave of adjacent shards, newest first: about one page each, so no more
+            # shards than the remaining budget fills
+            budget = self.max_entries - total
+            wave_size = min(self.concurrency, -(-budget // self.page_limit)) if self.calibrated else 1
+            wave = []
+            while cursor > start_ns and len(wave) < wave_size:
+                # When one page can hold the whole remaining budget, the rest of the range is one shard
+                shard_ns = cursor - start_ns if budget <= self.page_limit else self.shard_ns
+                shard_start = max(start_ns, cursor - shard_ns)
+                wave.append((shard_start, cursor))
+                cursor = shard_start
+
+            results = await asyncio.gather(*[self._run_shard(start, end, budget) for start, end in wave])
+            if any(result is None for result in results):
+                return None
+
+            seen = 0
+            for shard_streams, count in results:
+                streams.extend(shard_streams)
+                seen += count
+            total += seen
+
+            self._adapt(seen, sum(end - start for start, end in wave))
+
+        if total > self.max_entries:
+            streams = self._trim(streams)
+
+        return streams
+
+    async def _run_shard(self, start_ns: int, end_ns: int, budget: int) -> Optional[Tuple[List[Stream], int]]:
+        """Follow the pagination cursor of one shard until it is exhausted or the budget is spent"""
+        streams: List[Stream] = []
+        count = 0
+        end = end_ns
+        carried = 0
+
+        while count < budget:
+            # Entries at the previous cursor timestamp come back first: ask for that many more
+            limit = min(self.page_limit, budget - count) + carried
+            page = await self.fetch_page(start_ns, end, limit)
+            if page is None:
+                return None
+
+            page_count = sum(len(entries) for _, entries in page)
+            if page_count < limit or page_count - carried >= budget - count:
+                streams.extend(page)
+                count += page_count
+                break  # Shard exhausted, or the budget is filled: its oldest timestamp is the cut
+
+            # The oldest timestamp may continue past the page: drop it here, the next page
+            # (ending just after it) returns all of its entries
+            boundary = min(self.timestamp_ns(entries[-1]) for _, entries in page if entries)
+            if boundary + 1 >= end:
+                logger.warning("Loki page holds more entries at one timestamp than the page limit")
+                streams.extend(page)
+                count += page_count
+                break
+
+            kept = [(key, [entry for entry in entries if self.timestamp_ns(entry) != boundary]) for key, entries in page]
+            streams.extend(kept)
+            kept_count = sum(len(entries) for _, entries in kept)
+            count += kept_count
+            carried = page_count - kept_count
+            end = boundary + 1
+
+        return streams, count
+
+    def _adapt(self, entries: int, covered_ns: int) -> None:
+        """Size the next shards for about one page each at the density just observed"""
+        if covered_ns <= 0:
+            return
+        self.calibrated = True
+        if entries == 0:
+            self.shard_ns = self._clamp(self.shard_ns * 2)
+            return
+        self.shard_ns = self._clamp(int(self.page_limit * covered_ns / entries))
+
+    def _trim(self, streams: List[Stream]) -> List[Stream]:
+        """Keep only the newest max_entries entries"""
+        newest = heapq.nlargest(
+            self.max_entries,
+            (self.timestamp_ns(entry) for _, entries in streams for entry in entries)
+        )
+        cutoff = newest[-1]
+        return [
+            (key, [entry for entry in entries if self.timestamp_ns(entry) >= cutoff])
+            for key, entries in streams
+        ]
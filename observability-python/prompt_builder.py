@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Token-Budgeted Prompt Builder
+=============================
+
+Assembles the AI analysis prompt within a token budget. Required parts
+(overview, instructions) are always included; candidate sections such as
+log templates and metrics are ranked by score (severity and novelty) and
+added greedily while they fit, then rendered back in their original order.
+"""
+
+import math
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+try:
+    import tiktoken
+except ImportError:  # Optional: fall back to a character-based estimate
+    tiktoken = None
+
+_encoding = None
+
+
+def estimate_tokens(text: str) -> int:
+    """Token count of a text, exact with tiktoken installed, ~4 chars/token otherwise"""
+    global _encoding
+
+    if tiktoken is not None:
+        if _encoding is None:
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        return len(_encoding.encode(text))
+
+    return math.ceil(len(text) / 4)
+
+
+@dataclass
+class PromptItem:
+    """A candidate piece of prompt text"""
+    group: str
+    text: str
+    score: float
+    order: int
+    tokens: int
+
+
+class PromptBuilder:
+    """Greedy prompt assembly under a token budget"""
+
+    def __init__(self, budget_tokens: int):
+        self.budget_tokens = budget_tokens
+        self._head: List[str] = []
+        self._tail: List[str] = []
+        self._groups: Dict[str, str] = {}
+        self._items: List[PromptItem] = []
+
+    def header(self, text: str) -> None:
+        """Required text at the start of the prompt"""
+        self._head.append(text)
+
+    def footer(self, text: str) -> None:
+        """Required text at the end of the prompt"""
+        self._tail.append(text)
+
+    def group(self, name: str, heading: str) -> None:
+        """Declare a section; groups render in declaration order"""
+        self._groups[name] = heading
+
+    def add(self, group: str, text: str, score: float) -> None:
+        """Offer a candidate item for a group"""
+        self._items.append(PromptItem(group, text, score, len(self._items), estimate_tokens(text)))
+
+    def build(self) -> Dict[str, Any]:
+        """Render the prompt; returns the text plus budget statistics"""
+        required = ''.join(self._head) + ''.join(self._tail) + ''.join(self._groups.values())
+        used = estimate_tokens(required)
+
+        selected: List[PromptItem] = []
+        dropped: List[PromptItem] = []
+
+        for item in sorted(self._items, key=lambda i: (-i.score, i.order)):
+            if used + item.tokens <= self.budget_tokens:
+                selected.append(item)
+                used += item.tokens
+            else:
+                dropped.append(item)
+
+        parts = list(self._head)
+        for name, heading in self._groups.items():
+            parts.append(heading)
+            parts.extend(item.text for item in sorted(selected, key=lambda i: i.order) if item.group == name)
+            omitted = sum(1 for item in dropped if item.group == name)
+            if omitted:
+                parts.append(f"\n({omitted} lower-priority entries omitted to fit the prompt budget)\n")
+        parts.extend(self._tail)
+
+        prompt = ''.join(parts)
+        return {
+            'prompt': prompt,
+            'estimated_tokens': estimate_tokens(prompt),
+            'budget_tokens': self.budget_tokens,
+            'items_included': len(selected),
+            'items_dropped': len(dropped)
+        }
+
+
+def severity_score(severity: str, novel: bool = False, count: Optional[int] = None) -> float:
+    """Rank for a prompt item: severity first, new items next, frequency last"""
+    base = {'CRITICAL': 4, 'ERROR': 3, 'WARNING': 2, 'PERFORMANCE': 1}.get(severity, 0)
+    score = base * 10 + (5 if novel else 0)
+    if count:
+        score += min(math.log10(count + 1), 4)
+    return score
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+AI Response Cache
+=================
+
+Persistent cache of Azure OpenAI analyses keyed by a fingerprint of the
+incident state. During calm periods consecutive monitoring cycles see the
+same log templates and the same metric alerts, so the previous analysis is
+reused instead of paying for a new completion.
+
+The fingerprint only covers what the analysis is about (templates,
+severities, metric names); counts and timestamps are left out so the key
+stays stable while the same problems keep happening.
+"""
+
+import hashlib
+import json
+import os
+import time
+from typing import Any, Dict, Iterable, List, Optional
+
+
+def incident_fingerprint(templates: Iterable[Any], metrics: Iterable[Dict[str, Any]]) -> str:
+    """Stable hash of the log templates (with severity) and alerting metric names"""
+    state = {
+        'templates': sorted({(t.severity, t.template) for t in templates}),
+        'metrics': sorted({(m['severity'], m['metric_name']) for m in metrics})
+    }
+    encoded = json.dumps(state, sort_keys=True, separators=(',', ':')).encode('utf-8')
+    return hashlib.sha256(encoded).hexdigest()
+
+
+class ResponseCache:
+    """JSON file cache with TTL and size-based eviction"""
+
+    def __init__(self, path: str, ttl_seconds: int = 3600, max_entries: int = 100):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: Dict[str, Dict[str, Any]] = self._load()
+
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+            return entries if isinstance(entries, dict) else {}
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self) -> None:
+        # Write-then-rename so a crash never leaves a truncated cache file
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._entries, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def _expired(self, entry: Dict[str, Any], now: float) -> bool:
+        return now - entry['created'] > self.ttl_seconds
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Cached entry (response, created, hits) if present and fresh"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        now = time.time()
+        if self._expired(entry, now):
+            del self._entries[key]
+            self._save()
+            return None
+
+        entry['hits'] = entry.get('hits', 0) + 1
+        entry['last_used'] = now
+        self._save()
+        return entry
+
+    def put(self, key: str, response: str) -> None:
+        """Store a response, evicting expired and then least recently used entries"""
+        now = time.time()
+        self._entries[key] = {'response': response, 'created': now, 'last_used': now, 'hits': 0}
+
+        for stale in [k for k, entry in self._entries.items() if self._expired(entry, now)]:
+            del self._entries[stale]
+
+        if len(self._entries) > self.max_entries:
+            by_use: List[str] = sorted(self._entries, key=lambda k: self._entries[k]['last_used'])
+            for old in by_use[:len(self._entries) - self.max_entries]:
+                del self._entries[old]
+
+        self._save()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Rolling Observability Window
+============================
+
+Bounded, time-indexed ring buffer used by continuous monitoring. Instead of
+re-downloading the whole analysis window every cycle, the analyzer keeps the
+entries it has already seen here, fetches only what is newer than each
+query's high-water mark and evicts whatever falls out of the window.
+"""
+
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Any, Callable, Deque, Dict, Hashable, Iterable, List, Optional, Tuple
+
+
+def log_entry_key(entry: Any) -> Hashable:
+    """Identity of a Loki log record, used to drop lines re-fetched by the overlap"""
+    return (
+        entry.timestamp_ns,
+        entry.namespace,
+        entry.pod,
+        entry.container,
+        entry.log_line
+    )
+
+
+def dict_timestamp_ns(entry: Dict[str, Any]) -> int:
+    """Timestamp of a dict entry with a 'timestamp' datetime, in nanoseconds"""
+    return to_ns(entry['timestamp'])
+
+
+def to_ns(moment: datetime) -> int:
+    return int(moment.timestamp() * 1_000_000_000)
+
+
+class RollingWindow:
+    """Ring buffer of timestamped entries with per-query high-water marks"""
+
+    def __init__(self, window: timedelta, max_entries: int,
+                 key: Callable[[Any], Hashable] = log_entry_key,
+                 timestamp_ns: Callable[[Any], int] = dict_timestamp_ns):
+        self.window = window
+        self.max_entries = max_entries
+        self.key = key
+        self.timestamp_ns = timestamp_ns
+        self.high_water: Dict[str, int] = {}
+
+        # Entries are kept in arrival order, which is oldest-first per cycle
+        self._entries: Deque[Tuple[Hashable, Any]] = deque()
+        self._index: Dict[Hashable, Any] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def fetch_start(self, query: str, window_start_ns: int, overlap_ns: int = 0) -> int:
+        """Start of the next fetch for a query: its high-water mark minus the overlap"""
+        mark = self.high_water.get(query)
+        if mark is None:
+            return window_start_ns
+        return max(window_start_ns, mark - overlap_ns)
+
+    def advance(self, query: str, end_ns: int) -> None:
+        """Record that a query has been fetched successfully up to end_ns"""
+        self.high_water[query] = max(end_ns, self.high_water.get(query, end_ns))
+
+    def add(self, entries: Iterable[Any], merge: Optional[Callable[[Any, Any], None]] = None) -> int:
+        """Append new entries; already buffered ones are skipped or passed to merge(existing, new)"""
+        added = 0
+
+        for entry in sorted(entries, key=self.timestamp_ns):
+            entry_key = self.key(entry)
+            existing = self._index.get(entry_key)
+            if existing is not None:
+                if merge is not None:
+                    merge(existing, entry)
+                continue
+
+            self._entries.append((entry_key, entry))
+            self._index[entry_key] = entry
+            added += 1
+
+            # Hard bound on memory: drop the oldest entries first
+            if len(self._entries) > self.max_entries:
+                old_key, _ = self._entries.popleft()
+                self._index.pop(old_key, None)
+
+        return added
+
+    def evict(self, now: Optional[datetime] = None) -> int:
+        """Drop entries older than the window; returns how many were evicted"""
+        cutoff = to_ns((now or datetime.now()) - self.window)
+        evicted = 0
+
+        while self._entries and self.timestamp_ns(self._entries[0][1]) < cutoff:
+            old_key, _ = self._entries.popleft()
+            self._index.pop(old_key, None)
+            evicted += 1
+
+        return evicted
+
+    def entries(self, now: Optional[datetime] = None) -> List[Any]:
+        """Buffered entries inside the window, newest first"""
+        cutoff = to_ns((now or datetime.now()) - self.window)
+        return sorted(
+            (entry for _, entry in self._entries if self.timestamp_ns(entry) >= cutoff),
+            key=self.timestamp_ns,
+            reverse=True
+        )
+
+    def first_seen(self, series: Callable[[Any], Hashable]) -> Dict[Hashable, int]:
+        """Oldest buffered timestamp (ns) of every series, e.g. since when a metric has been alerting"""
+        first: Dict[Hashable, int] = {}
+
+        for _, entry in self._entries:
+            name = series(entry)
+            timestamp = self.timestamp_ns(entry)
+            if name not in first or timestamp < first[name]:
+                first[name] = timestamp
+
+        return first
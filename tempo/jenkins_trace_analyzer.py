@@ -16,18 +16,237 @@ Autor: Platform Engineer
 Fecha: 2025-07-25
 """
 
-import requests
+import os
+import sys
+import asyncio
+import aiohttp
 import json
 import time
 import datetime
-from typing import Dict, List, Optional, Any
-from dataclasses import dataclass
+from typing import Awaitable, Dict, Iterable, List, Optional, Any, Tuple
+from dataclasses import dataclass, field
 import logging
+import marshal
+from array import array
+from bisect import bisect_left
+from operator import itemgetter
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# Capa HTTP compartida con observability-python (pools keep-alive por backend)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'observability-python'))
+from http_clients import BackendConfig, HttpClientPool
+from json_stream import JSON_ERRORS, iter_items_async, loads
+from log_classifier import KeywordClassifier
+from loki_shards import ShardedQueryExecutor
+from trace_cache import TraceCache
+from span_table import SpanTable
+from latency_sketches import LatencyBaselines
+from span_tree import rank_latency_drivers
+from trace_log_index import TraceLogIndex
+from otlp_traces import HAS_OTLP, PROTOBUF_CONTENT_TYPE, SpanRecord, decode_trace
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Palabras clave de logs compiladas una sola vez; cada línea se escanea una única vez
+LOG_KEYWORDS = KeywordClassifier([
+    ('error', ['error', 'exception', 'failed']),
+    ('timeout', ['timeout']),
+    ('warning', ['warning', 'warn', 'retry'])
+])
+
+def problematic_traces_query(service_name: str, min_duration_seconds: float = 5,
+                             error_attributes: Optional[List[str]] = None) -> str:
+    """Consulta TraceQL con los criterios de _identify_problematic_traces que Tempo puede evaluar"""
+    conditions = ["status=error", f"duration>{min_duration_seconds:g}s"]
+    # Los tags con "error"/"fail" solo se pueden buscar en atributos concretos
+    conditions += [f'span.{attribute}=~"(?i).*(error|fail).*"' for attribute in error_attributes or []]
+    return f'{{ resource.service.name="{service_name}" && ({" || ".join(conditions)}) }}'
+
+def merge_windows(windows: List[Tuple[int, int]]) -> List[Tuple[int, int, List[int]]]:
+    """Une las ventanas [inicio, fin) que se solapan; devuelve (inicio, fin, índices de las ventanas)"""
+    merged: List[Tuple[int, int, List[int]]] = []
+    for i in sorted(range(len(windows)), key=lambda i: windows[i]):
+        start, end = windows[i]
+        if merged and start <= merged[-1][1]:
+            merged_start, merged_end, members = merged[-1]
+            merged[-1] = (merged_start, max(merged_end, end), members + [i])
+        else:
+            merged.append((start, end, [i]))
+    return merged
+
+async def gather_until(coroutines: Iterable[Awaitable[Any]], deadline: Optional[float] = None) -> Tuple[List[Any], int]:
+    """Ejecuta las corrutinas en paralelo hasta deadline (reloj del bucle, None = sin límite)
+
+    Nunca deja tareas vivas: al vencer el plazo (o si se cancela al llamante) las
+    pendientes se cancelan y se esperan. Devuelve (resultados en orden, con None para
+    las canceladas o fallidas; cuántas se cancelaron por el plazo).
+    """
+    tasks = [asyncio.ensure_future(coroutine) for coroutine in coroutines]
+    if not tasks:
+        return [], 0
+    
+    timeout = None if deadline is None else max(0.0, deadline - asyncio.get_running_loop().time())
+    try:
+        _, pending = await asyncio.wait(tasks, timeout=timeout)
+    finally:
+        # Si se cancela al llamante, sus tareas no sobreviven
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    
+    results = []
+    for task in tasks:
+        if task.cancelled():
+            results.append(None)
+        elif task.exception() is not None:
+            logger.error(f"Error en tarea de análisis: {task.exception()}")
+            results.append(None)
+        else:
+            results.append(task.result())
+    return results, len(pending)
+
+def _remaining(deadline: Optional[float]) -> Optional[float]:
+    """Segundos que quedan hasta deadline (None = sin límite)"""
+    if deadline is None:
+        return None
+    return max(0.0, deadline - asyncio.get_running_loop().time())
+
+class BackendLimiter:
+    """Semáforo de peticiones simultáneas a un backend, uno por bucle de eventos"""
+    
+    def __init__(self, concurrency: int):
+        self.concurrency = max(1, concurrency)
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._loop = None
+    
+    def __call__(self) -> asyncio.Semaphore:
+        # Un semáforo queda ligado a su bucle: cada asyncio.run necesita uno nuevo
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+            self._loop = loop
+        return self._semaphore
+
+def correlation_summary(operation_name: str, duration: int, status_code: str,
+                        lines: List[str], trace_log_count: int = 0) -> str:
+    """Resumen de la correlación entre una traza y las líneas de log de su ventana"""
+    
+    # Análisis básico de patrones en logs
+    error_lines = [
+        line for line in lines 
+        if LOG_KEYWORDS.labels(line) & {'error', 'timeout'}
+    ]
+    
+    warning_count = sum(
+        1 for line in lines 
+        if LOG_KEYWORDS.has(line, 'warning')
+    )
+    
+    analysis_parts = []
+    
+    # Información de la traza
+    duration_ms = duration / 1000000  # Convertir a milisegundos
+    analysis_parts.append(f"Traza {operation_name} duró {duration_ms:.2f}ms")
+    
+    if status_code in ['ERROR', 'FAILED', '2']:
+        analysis_parts.append(f"Estado: {status_code}")
+    
+    # Logs que llevan el trace ID: relación exacta, no solo por tiempo
+    if trace_log_count:
+        analysis_parts.append(f"🔗 {trace_log_count} logs con el trace ID")
+    
+    # Análisis de logs correlacionados
+    if error_lines:
+        analysis_parts.append(f"🔴 {len(error_lines)} logs de error encontrados")
+        # Mostrar el primer error
+        analysis_parts.append(f"Primer error: {error_lines[0][:200]}")
+    
+    if warning_count:
+        analysis_parts.append(f"🟡 {warning_count} warnings encontrados")
+    
+    # Análisis de patrones temporales
+    if len(lines) > 10:
+        analysis_parts.append(f"📊 Alta actividad: {len(lines)} logs en ventana de 10min")
+    
+    return " | ".join(analysis_parts) if analysis_parts else "Sin patrones significativos detectados"
+
+def severity_level(status_code: str, duration: int, thresholds: Tuple[float, float, float],
+                   lines: List[str]) -> str:
+    """Severidad de un evento; thresholds son los umbrales (crítico, lento, elevado) en nanosegundos"""
+    
+    score = 0
+    
+    # Puntuación por estado de traza
+    if status_code in ['ERROR', 'FAILED', '2']:
+        score += 3
+    
+    # Puntuación por duración, relativa a la latencia habitual de la operación
+    critical, slow, elevated = thresholds
+    if duration > critical:
+        score += 3
+    elif duration > slow:
+        score += 2
+    elif duration > elevated:
+        score += 1
+    
+    # Puntuación por logs de error
+    error_count = sum(
+        1 for line in lines 
+        if LOG_KEYWORDS.has(line, 'error')
+    )
+    score += min(error_count, 3)
+    
+    # Clasificación final
+    if score >= 6:
+        return "CRITICAL"
+    elif score >= 4:
+        return "HIGH"
+    elif score >= 2:
+        return "MEDIUM"
+    else:
+        return "LOW"
+
+def _pack_chunk(items: List[Tuple[Any, List[Dict[str, Any]], Tuple[float, float, float], int]]) -> bytes:
+    """Serializa un bloque de trazas para un proceso trabajador
+
+    Las ventanas de trazas cercanas se solapan: cada línea distinta viaja una sola vez y
+    cada traza lleva solo las posiciones de sus líneas (array de uint32), en lugar de
+    repetir los dicts de log con sus labels en cada ventana.
+    """
+    line_ids: Dict[str, int] = {}
+    lines: List[str] = []
+    traces = []
+    for trace, logs, thresholds, trace_log_count in items:
+        positions = array('I')
+        for log in logs:
+            line = log['line']
+            line_id = line_ids.get(line)
+            if line_id is None:
+                line_id = line_ids[line] = len(lines)
+                lines.append(line)
+            positions.append(line_id)
+        traces.append((trace.operation_name, trace.duration, trace.status_code,
+                       tuple(thresholds), trace_log_count, positions.tobytes()))
+    return marshal.dumps((lines, traces))
+
+def _analyze_chunk(payload: bytes) -> List[Tuple[str, str]]:
+    """(análisis, severidad) de cada traza de un bloque de _pack_chunk, en un proceso trabajador"""
+    lines, traces = marshal.loads(payload)
+    results = []
+    for operation_name, duration, status_code, thresholds, trace_log_count, packed in traces:
+        positions = array('I')
+        positions.frombytes(packed)
+        window = [lines[i] for i in positions]
+        results.append((
+            correlation_summary(operation_name, duration, status_code, window, trace_log_count),
+            severity_level(status_code, duration, thresholds, window)
+        ))
+    return results
+
 @dataclass
 class TraceSpan:
     """Representa un span de traza de Tempo"""
@@ -39,6 +258,7 @@ class TraceSpan:
     duration: int
     status_code: str
     tags: Dict[str, Any]
+    parent_span_id: str = ''
 
 @dataclass
 class CorrelatedEvent:
@@ -47,25 +267,99 @@ class CorrelatedEvent:
     logs: List[Dict[str, Any]]
     analysis: str
     severity: str
+    # Logs unidos por identificador exacto (trace ID en la línea), y los de este span
+    trace_logs: List[Dict[str, Any]] = field(default_factory=list)
+    span_logs: List[Dict[str, Any]] = field(default_factory=list)
 
 class TempoClient:
-    """Cliente para consultar trazas de Tempo"""
+    """Cliente asíncrono para consultar trazas de Tempo"""
     
-    def __init__(self, tempo_url: str = "http://localhost:3200"):
+    def __init__(self, tempo_url: str = "http://localhost:3200",
+                 http: Optional[HttpClientPool] = None):
         self.tempo_url = tempo_url.rstrip('/')
+        self.http = http or HttpClientPool([BackendConfig.from_env("tempo", self.tempo_url)])
+        self.max_response_bytes = self.http.config("tempo").max_response_bytes
+        # Todas las peticiones a Tempo (búsqueda y descargas) comparten un límite de concurrencia
+        self.limit = BackendLimiter(int(os.getenv("TEMPO_FETCH_CONCURRENCY", 8)))
+        
+        # Las trazas terminadas no cambian: se guardan entre ejecuciones
+        self.cache = TraceCache.from_env()
+        self.cache_min_age_ns = int(float(os.getenv("TRACE_CACHE_MIN_AGE_SECONDS", 300)) * 1000000000)
+        
+        # "protobuf" pide las trazas en OTLP binario (requiere opentelemetry-proto)
+        self.use_protobuf = os.getenv("TEMPO_TRACE_FORMAT", "json").lower() == "protobuf"
+        if self.use_protobuf and not HAS_OTLP:
+            logger.warning("TEMPO_TRACE_FORMAT=protobuf requiere opentelemetry-proto; se usa JSON")
+            self.use_protobuf = False
         
-    def search_traces(self, 
-                     service_name: str = "jenkins-master",
-                     start_time: Optional[int] = None,
-                     end_time: Optional[int] = None,
-                     limit: int = 100) -> List[TraceSpan]:
-        """Busca trazas en Tempo"""
+    async def search_traces(self, 
+                            service_name: str = "jenkins-master",
+                            start_time: Optional[int] = None,
+                            end_time: Optional[int] = None,
+                            limit: int = 100,
+                            traceql: Optional[str] = None,
+                            deadline: Optional[float] = None) -> List[TraceSpan]:
+        """Busca trazas en Tempo (por tags, o solo las que cumplen una consulta TraceQL)"""
+        
+        return [
+            TraceSpan(trace_id, *record)
+            for trace_id, records in await self._search_records(service_name, start_time, end_time, limit, traceql, deadline)
+            for record in records
+        ]
+    
+    async def search_span_table(self,
+                                service_name: str = "jenkins-master",
+                                start_time: Optional[int] = None,
+                                end_time: Optional[int] = None,
+                                limit: int = 100,
+                                traceql: Optional[str] = None,
+                                deadline: Optional[float] = None) -> SpanTable:
+        """Igual que search_traces, pero con los spans en una tabla columnar"""
+        
+        return SpanTable(await self._search_records(service_name, start_time, end_time, limit, traceql, deadline))
+    
+    async def _search_records(self, service_name: str, start_time: Optional[int], end_time: Optional[int],
+                              limit: int, traceql: Optional[str],
+                              deadline: Optional[float] = None) -> List[Tuple[str, List[SpanRecord]]]:
+        """Busca trazas y descarga sus spans: (trace_id, registros) en el orden de la búsqueda
+
+        Con deadline, las trazas que no se han descargado a tiempo se omiten.
+        """
         
         if not start_time:
             start_time = int((datetime.datetime.now() - datetime.timedelta(hours=1)).timestamp() * 1000000000)
         if not end_time:
             end_time = int(datetime.datetime.now().timestamp() * 1000000000)
-            
+        
+        try:
+            trace_ids = await asyncio.wait_for(
+                self._search_ids(service_name, start_time, end_time, limit, traceql),
+                _remaining(deadline)
+            )
+        except asyncio.TimeoutError:
+            logger.warning("⏱️ Búsqueda en Tempo cancelada por el límite de tiempo del análisis")
+            return []
+        if trace_ids is None:
+            return []
+        
+        # Obtener detalles completos de las trazas en paralelo, en el orden de la búsqueda
+        results, timed_out = await gather_until([self._trace_records(trace_id) for trace_id in trace_ids], deadline)
+        traces = [(trace_id, records) for trace_id, records in zip(trace_ids, results) if records]
+        
+        failed = len(trace_ids) - len(traces) - timed_out
+        if failed:
+            logger.warning(f"{failed} de {len(trace_ids)} trazas sin detalles")
+        if timed_out:
+            logger.warning(f"⏱️ {timed_out} de {len(trace_ids)} trazas sin descargar por el límite de tiempo")
+        if self.cache:
+            logger.info(f"Caché de trazas: {self.cache.hits} aciertos, {self.cache.misses} descargas")
+        
+        return traces
+    
+    async def _search_ids(self, service_name: str, start_time: int, end_time: int,
+                          limit: int, traceql: Optional[str]) -> Optional[List[str]]:
+        """Trace IDs de la búsqueda en Tempo; None si falla"""
+        
         # Tempo API search endpoint
         search_url = f"{self.tempo_url}/api/search"
         params = {
@@ -74,161 +368,402 @@ class TempoClient:
             'end': end_time,
             'limit': limit
         }
+        if traceql:
+            # El filtrado se hace en Tempo: solo se descargan las trazas que coinciden
+            del params['tags']
+            params['q'] = traceql
         
+        session = await self.http.session("tempo")
+        traces_data = None
         try:
-            response = requests.get(search_url, params=params, timeout=30)
-            response.raise_for_status()
+            async with self.limit():
+                async with session.get(search_url, params=params) as response:
+                    if traceql and response.status == 400:
+                        logger.warning(f"Tempo rechazó la consulta TraceQL ({(await response.text()).strip()}); se busca por tags")
+                    else:
+                        response.raise_for_status()
+                        traces_data = loads(await response.read())
             
-            traces_data = response.json()
-            traces = []
+            if traces_data is None:
+                # Fuera del semáforo: la búsqueda por tags espera su propio turno
+                return await self._search_ids(service_name, start_time, end_time, limit, None)
             
-            for trace_data in traces_data.get('traces', []):
-                trace_id = trace_data.get('traceID')
-                if trace_id:
-                    # Obtener detalles completos de la traza
-                    trace_details = self.get_trace_details(trace_id)
-                    if trace_details:
-                        traces.extend(trace_details)
-                        
-            return traces
+            return [t.get('traceID') for t in traces_data.get('traces', []) if t.get('traceID')]
             
-        except requests.RequestException as e:
+        except (aiohttp.ClientError, asyncio.TimeoutError, *JSON_ERRORS) as e:
             logger.error(f"Error consultando Tempo: {e}")
-            return []
+            return None
     
-    def get_trace_details(self, trace_id: str) -> List[TraceSpan]:
+    async def get_trace_details(self, trace_id: str) -> List[TraceSpan]:
         """Obtiene detalles completos de una traza"""
         
+        return [TraceSpan(trace_id, *record) for record in await self._trace_records(trace_id) or []]
+    
+    async def _trace_records(self, trace_id: str) -> Optional[List[SpanRecord]]:
+        """Registros de los spans de una traza, desde la caché o descargados"""
+        
+        if self.cache:
+            truncated = []
+            records = await self.cache.get_or_fetch_async(
+                trace_id,
+                lambda: self._download_trace(trace_id, truncated),
+                cacheable=lambda records: not truncated and self._is_finished(records)
+            )
+        else:
+            records = await self._download_trace(trace_id)
+        
+        return records
+    
+    async def _download_trace(self, trace_id: str, truncated: Optional[List[bool]] = None) -> Optional[List[SpanRecord]]:
+        """Descarga los spans de una traza como registros compactos; None si falla. Si llega truncada lo anota en truncated"""
+        
         trace_url = f"{self.tempo_url}/api/traces/{trace_id}"
+        truncated = truncated if truncated is not None else []
+        session = await self.http.session("tempo")
         
         try:
-            response = requests.get(trace_url, timeout=30)
-            response.raise_for_status()
-            
-            trace_data = response.json()
-            spans = []
-            
-            for batch in trace_data.get('batches', []):
-                for span_data in batch.get('spans', []):
-                    span = TraceSpan(
-                        trace_id=trace_id,
-                        span_id=span_data.get('spanID', ''),
-                        service_name=self._extract_service_name(span_data),
-                        operation_name=span_data.get('operationName', ''),
-                        start_time=span_data.get('startTimeUnixNano', 0),
-                        duration=span_data.get('durationNanos', 0),
-                        status_code=self._extract_status_code(span_data),
-                        tags=self._extract_tags(span_data)
-                    )
-                    spans.append(span)
+            async with self.limit():
+                if self.use_protobuf:
+                    return await self._download_protobuf(session, trace_url, trace_id)
+                
+                async with session.get(trace_url) as response:
+                    response.raise_for_status()
                     
-            return spans
+                    # Los batches se procesan a medida que llegan, con límite de tamaño
+                    return [
+                        self._span_record(span_data)
+                        async for batch in iter_items_async(response, 'batches.item', self.max_response_bytes,
+                                                            f"Traza {trace_id}", on_truncated=lambda: truncated.append(True))
+                        for span_data in batch.get('spans', [])
+                    ]
             
-        except requests.RequestException as e:
+        except (aiohttp.ClientError, asyncio.TimeoutError, *JSON_ERRORS) as e:
             logger.error(f"Error obteniendo detalles de traza {trace_id}: {e}")
-            return []
+            return None
     
-    def _extract_service_name(self, span_data: Dict) -> str:
-        """Extrae el nombre del servicio de un span"""
-        for tag in span_data.get('tags', []):
-            if tag.get('key') == 'service.name':
-                return tag.get('vStr', '')
-        return 'unknown'
+    async def _download_protobuf(self, session: aiohttp.ClientSession, trace_url: str,
+                                 trace_id: str) -> Optional[List[SpanRecord]]:
+        """Descarga una traza en OTLP protobuf; una traza binaria truncada no se puede decodificar"""
+        
+        async with session.get(trace_url, headers={'Accept': PROTOBUF_CONTENT_TYPE}) as response:
+            response.raise_for_status()
+            data = bytearray()
+            while len(data) <= self.max_response_bytes:
+                chunk = await response.content.read(self.max_response_bytes + 1 - len(data))
+                if not chunk:
+                    break
+                data += chunk
+        
+        if len(data) > self.max_response_bytes:
+            logger.warning(f"Traza {trace_id}: supera {self.max_response_bytes / (1024 * 1024):g} MB, se descarta")
+            return None
+        
+        # DecodeError de protobuf hereda de Exception; se registra como cualquier traza ilegible
+        try:
+            return decode_trace(bytes(data))
+        except Exception as e:
+            logger.error(f"Error decodificando traza {trace_id}: {e}")
+            return None
     
-    def _extract_status_code(self, span_data: Dict) -> str:
-        """Extrae el código de estado de un span"""
-        for tag in span_data.get('tags', []):
-            if tag.get('key') == 'otel.status_code':
-                return tag.get('vStr', '')
-        return 'unset'
+    def _is_finished(self, records: List[SpanRecord]) -> bool:
+        """Una traza se considera terminada si su último span acabó hace más de TRACE_CACHE_MIN_AGE_SECONDS"""
+        if not records:
+            return False
+        last_end = max(int(record[3]) + int(record[4]) for record in records)
+        return time.time_ns() - last_end > self.cache_min_age_ns
     
-    def _extract_tags(self, span_data: Dict) -> Dict[str, Any]:
-        """Extrae todos los tags de un span"""
+    @staticmethod
+    def _span_record(span_data: Dict) -> SpanRecord:
+        """Convierte un span JSON en un registro, recorriendo sus tags una sola vez"""
+        service_name = None
+        status_code = None
         tags = {}
+        
         for tag in span_data.get('tags', []):
             key = tag.get('key', '')
+            if key == 'service.name' and service_name is None:
+                service_name = tag.get('vStr', '')
+            elif key == 'otel.status_code' and status_code is None:
+                status_code = tag.get('vStr', '')
+            
             if 'vStr' in tag:
                 tags[key] = tag['vStr']
             elif 'vInt64' in tag:
                 tags[key] = tag['vInt64']
             elif 'vBool' in tag:
                 tags[key] = tag['vBool']
-        return tags
+        
+        return (
+            span_data.get('spanID', ''),
+            'unknown' if service_name is None else service_name,
+            span_data.get('operationName', ''),
+            span_data.get('startTimeUnixNano', 0),
+            span_data.get('durationNanos', 0),
+            'unset' if status_code is None else status_code,
+            tags,
+            span_data.get('parentSpanID', '')
+        )
 
 class LokiClient:
-    """Cliente para consultar logs de Loki"""
+    """Cliente asíncrono para consultar logs de Loki"""
     
-    def __init__(self, loki_url: str = "http://localhost:3100"):
+    def __init__(self, loki_url: str = "http://localhost:3100",
+                 http: Optional[HttpClientPool] = None):
         self.loki_url = loki_url.rstrip('/')
+        self.http = http or HttpClientPool([BackendConfig.from_env("loki", self.loki_url)])
+        self.max_response_bytes = self.http.config("loki").max_response_bytes
+        # Límite de peticiones simultáneas a Loki, sumando todas las ventanas y sus tramos
+        self.limit = BackendLimiter(int(os.getenv("LOKI_QUERY_CONCURRENCY", 6)))
+        
+        # Consultas divididas en tramos de tiempo paginados; el tamaño del tramo se adapta
+        self.page_limit = int(os.getenv("LOKI_PAGE_LIMIT", 1000))
+        self.shard_seconds = float(os.getenv("LOKI_SHARD_SECONDS", 900))
+        self.shard_concurrency = int(os.getenv("LOKI_SHARD_CONCURRENCY", 4))
         
-    def query_logs_around_time(self, 
-                              timestamp: int,
-                              window_minutes: int = 5,
-                              namespace: str = "jenkins") -> List[Dict[str, Any]]:
+    async def query_logs_around_time(self, 
+                                     timestamp: int,
+                                     window_minutes: int = 5,
+                                     namespace: str = "jenkins",
+                                     limit: int = 1000) -> List[Dict[str, Any]]:
         """Consulta logs alrededor de un timestamp específico"""
         
+        start_ns, end_ns = self._window(timestamp, window_minutes)
+        return await self._query_range(self._logql_query(namespace), start_ns, end_ns, limit) or []
+    
+    async def query_logs_around_times(self,
+                                      timestamps: List[int],
+                                      window_minutes: int = 5,
+                                      namespace: str = "jenkins",
+                                      limit: int = 1000,
+                                      deadline: Optional[float] = None) -> List[List[Dict[str, Any]]]:
+        """Igual que query_logs_around_time para varios timestamps, con una consulta por grupo de ventanas solapadas
+
+        Los grupos se consultan en paralelo; con deadline, las ventanas de los grupos que no
+        han terminado a tiempo quedan vacías.
+        """
+        
+        logql_query = self._logql_query(namespace)
+        windows = [self._window(timestamp, window_minutes) for timestamp in timestamps]
+        groups = merge_windows(windows)
+        results: List[List[Dict[str, Any]]] = [[] for _ in windows]
+        
+        group_results, timed_out = await gather_until(
+            [self._query_group(logql_query, windows, group, limit) for group in groups],
+            deadline
+        )
+        
+        refetched = 0
+        for group_result in group_results:
+            if group_result is None:
+                continue
+            group_windows, group_refetched = group_result
+            refetched += group_refetched
+            for i, logs in group_windows.items():
+                results[i] = logs
+        
+        if len(windows) > len(groups) or refetched:
+            logger.info(f"🔗 {len(windows)} ventanas de logs resueltas con {len(groups) + refetched} consultas a Loki")
+        if timed_out:
+            logger.warning(f"⏱️ {timed_out} de {len(groups)} consultas a Loki canceladas por el límite de tiempo")
+        
+        return results
+    
+    async def _query_group(self, logql_query: str, windows: List[Tuple[int, int]],
+                           group: Tuple[int, int, List[int]],
+                           limit: int) -> Tuple[Dict[int, List[Dict[str, Any]]], int]:
+        """Logs de cada ventana de un grupo solapado ({índice: logs}) y cuántas se consultaron por separado"""
+        
+        group_start, group_end, members = group
+        group_limit = limit * len(members)
+        logs = await self._query_range(logql_query, group_start, group_end, group_limit)
+        if logs is None:
+            return {}, 0
+        
+        # Si se alcanzó el límite del grupo, solo está completo lo posterior al log más antiguo
+        timestamps_ns = [int(log['timestamp']) for log in logs]
+        complete_from = timestamps_ns[0] if len(logs) >= group_limit else group_start
+        
+        results: Dict[int, List[Dict[str, Any]]] = {}
+        cut = []
+        for i in members:
+            start_ns, end_ns = windows[i]
+            lo = bisect_left(timestamps_ns, start_ns)
+            hi = bisect_left(timestamps_ns, end_ns)
+            
+            if hi - lo > limit:
+                # Los `limit` más recientes de la ventana, con empates, como hace la consulta individual
+                lo = bisect_left(timestamps_ns, timestamps_ns[hi - limit], lo, hi)
+            elif hi - lo < limit and start_ns < complete_from:
+                # Ventana cortada por el límite del grupo: se consulta por separado
+                cut.append(i)
+                continue
+                
+            results[i] = logs[lo:hi]
+        
+        refetched = await asyncio.gather(*[self._query_range(logql_query, *windows[i], limit) for i in cut])
+        for i, window_logs in zip(cut, refetched):
+            results[i] = window_logs or []
+        
+        return results, len(cut)
+    
+    @staticmethod
+    def _window(timestamp: int, window_minutes: int) -> Tuple[int, int]:
+        """Ventana [inicio, fin) en nanosegundos alrededor de un timestamp, en segundos completos"""
         # Convertir nanosegundos a segundos
         timestamp_seconds = timestamp // 1000000000
         start_time = timestamp_seconds - (window_minutes * 60)
         end_time = timestamp_seconds + (window_minutes * 60)
+        return start_time * 1_000_000_000, end_time * 1_000_000_000
+    
+    @staticmethod
+    def _logql_query(namespace: str) -> str:
+        """Query LogQL para buscar logs relevantes"""
+        return f'{{namespace="{namespace}"}} | json | line_format "{{{{.timestamp}}}} [{{{{.level}}}}] {{{{.service}}}}: {{{{.message}}}}"'
+    
+    async def _query_range(self, logql_query: str, start_ns: int, end_ns: int,
+                           limit: int) -> Optional[List[Dict[str, Any]]]:
+        """Los `limit` logs más recientes de [start_ns, end_ns), en orden cronológico; None si falla"""
         
-        query_url = f"{self.loki_url}/loki/api/v1/query_range"
+        executor = ShardedQueryExecutor(
+            lambda start, end, page_limit: self._fetch_page(logql_query, start, end, page_limit),
+            page_limit=min(self.page_limit, limit),
+            max_entries=limit,
+            shard_seconds=self.shard_seconds,
+            concurrency=self.shard_concurrency,
+            timestamp_ns=lambda log: int(log['timestamp'])
+        )
+        streams = await executor.run(start_ns, end_ns)
+        self.shard_seconds = executor.shard_ns / 1_000_000_000
+        
+        if streams is None:
+            return None
+        
+        logs = [log for _, stream_logs in streams for log in stream_logs]
+        return sorted(logs, key=lambda x: x['timestamp'])
+    
+    async def _fetch_page(self, logql_query: str, start_ns: int, end_ns: int,
+                          limit: int) -> Optional[List[Any]]:
+        """Obtiene una página de resultados (streams con sus logs, del más nuevo al más antiguo)"""
         
-        # Query LogQL para buscar logs relevantes
-        logql_query = f'{{namespace="{namespace}"}} | json | line_format "{{{{.timestamp}}}} [{{{{.level}}}}] {{{{.service}}}}: {{{{.message}}}}"'
+        query_url = f"{self.loki_url}/loki/api/v1/query_range"
         
         params = {
             'query': logql_query,
-            'start': start_time,
-            'end': end_time,
-            'limit': 1000
+            'start': start_ns,
+            'end': end_ns,
+            'limit': limit,
+            'direction': 'backward'
         }
         
+        session = await self.http.session("loki")
         try:
-            response = requests.get(query_url, params=params, timeout=30)
-            response.raise_for_status()
-            
-            logs_data = response.json()
-            logs = []
-            
-            for stream in logs_data.get('data', {}).get('result', []):
-                stream_labels = stream.get('stream', {})
-                for values in stream.get('values', []):
-                    log_entry = {
-                        'timestamp': values[0],
-                        'line': values[1],
-                        'labels': stream_labels
-                    }
-                    logs.append(log_entry)
+            async with self.limit():
+                async with session.get(query_url, params=params) as response:
+                    response.raise_for_status()
+                    
+                    streams = []
+                    
+                    async for stream in iter_items_async(response, 'data.result.item', self.max_response_bytes, "Consulta Loki"):
+                        stream_labels = stream.get('stream', {})
+                        stream_logs = []
+                        for values in stream.get('values', []):
+                            log_entry = {
+                                'timestamp': values[0],
+                                'line': values[1],
+                                'labels': stream_labels
+                            }
+                            stream_logs.append(log_entry)
+                        streams.append((id(stream_labels), stream_logs))
                     
-            return sorted(logs, key=lambda x: x['timestamp'])
+                    return streams
             
-        except requests.RequestException as e:
+        except (aiohttp.ClientError, asyncio.TimeoutError, *JSON_ERRORS) as e:
             logger.error(f"Error consultando Loki: {e}")
-            return []
+            return None
 
 class JenkinsTraceAnalyzer:
     """Analizador principal que correlaciona trazas con logs"""
     
     def __init__(self, tempo_url: str = "http://localhost:3200", 
                  loki_url: str = "http://localhost:3100"):
-        self.tempo = TempoClient(tempo_url)
-        self.loki = LokiClient(loki_url)
+        # Un único pool HTTP para Tempo y Loki, reutilizado durante todo el análisis
+        self.http = HttpClientPool([
+            BackendConfig.from_env("tempo", tempo_url),
+            BackendConfig.from_env("loki", loki_url)
+        ])
+        self.tempo = TempoClient(tempo_url, http=self.http)
+        self.loki = LokiClient(loki_url, http=self.http)
+        
+        # "traceql" filtra las trazas problemáticas en Tempo en lugar de descargarlas todas
+        self.search_mode = os.getenv("TEMPO_SEARCH_MODE", "tags").lower()
+        self.error_attributes = [a.strip() for a in os.getenv("TEMPO_TRACEQL_ERROR_ATTRIBUTES", "").split(',') if a.strip()]
+        
+        # Latencia normal de cada (servicio, operación), acumulada entre ejecuciones
+        self.baselines = LatencyBaselines.from_env()
+        self.slow_quantile = float(os.getenv("LATENCY_SLOW_QUANTILE", 0.95))
+        self.critical_quantile = float(os.getenv("LATENCY_CRITICAL_QUANTILE", 0.99))
+        self.elevated_quantile = float(os.getenv("LATENCY_ELEVATED_QUANTILE", 0.90))
+        
+        # Operaciones en la ruta crítica de las trazas del último análisis
+        self.latency_drivers: List[Dict[str, Any]] = []
+        self.critical_paths: Dict[str, List[Tuple[Tuple[str, str], int]]] = {}
+        
+        # Presupuesto de tiempo del análisis: al agotarse se devuelven resultados parciales
+        self.time_budget = float(os.getenv("TRACE_ANALYSIS_BUDGET_SECONDS", 120))
+        self.incomplete_phases: List[str] = []
+        
+        # Procesos para el análisis por traza (1 = en serie, 0 = uno por núcleo)
+        self.analysis_workers = int(os.getenv("TRACE_ANALYSIS_WORKERS", 1)) or os.cpu_count() or 1
+        
+    async def close_async(self) -> None:
+        """Cierra todas las conexiones HTTP del pool"""
+        await self.http.close()
         
     def analyze_jenkins_failures(self, hours_back: int = 1) -> List[CorrelatedEvent]:
-        """Analiza fallos de Jenkins Master correlacionando trazas y logs"""
+        """Analiza fallos de Jenkins Master correlacionando trazas y logs (ver analyze_jenkins_failures_async)"""
+        
+        async def run() -> List[CorrelatedEvent]:
+            try:
+                return await self.analyze_jenkins_failures_async(hours_back)
+            finally:
+                # Las sesiones aiohttp pertenecen a este bucle de eventos
+                await self.close_async()
+        
+        return asyncio.run(run())
+        
+    async def analyze_jenkins_failures_async(self, hours_back: int = 1) -> List[CorrelatedEvent]:
+        """Analiza fallos de Jenkins Master correlacionando trazas y logs
+
+        Las descargas de Tempo y Loki se hacen en paralelo, limitadas por backend. Si se
+        agota TRACE_ANALYSIS_BUDGET_SECONDS se cancelan las pendientes y se analiza lo
+        obtenido hasta entonces; las fases afectadas quedan en incomplete_phases.
+        """
         
         logger.info(f"🔍 Analizando fallos de Jenkins en las últimas {hours_back} horas...")
         
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.time_budget if self.time_budget > 0 else None
+        self.incomplete_phases = []
+        
         # Buscar trazas de Jenkins Master
         end_time = int(datetime.datetime.now().timestamp() * 1000000000)
         start_time = int((datetime.datetime.now() - datetime.timedelta(hours=hours_back)).timestamp() * 1000000000)
         
-        traces = self.tempo.search_traces(
+        traceql = None
+        if self.search_mode == "traceql":
+            traceql = problematic_traces_query("jenkins-master", error_attributes=self.error_attributes)
+            logger.info(f"🔎 Búsqueda TraceQL: {traceql}")
+        
+        traces = await self.tempo.search_span_table(
             service_name="jenkins-master",
             start_time=start_time,
-            end_time=end_time
+            end_time=end_time,
+            traceql=traceql,
+            deadline=deadline
         )
+        traces_complete = deadline is None or loop.time() < deadline
+        if not traces_complete:
+            self.incomplete_phases.append("trazas de Tempo")
         
         logger.info(f"📊 Encontradas {len(traces)} trazas de Jenkins Master")
         
@@ -236,128 +771,126 @@ class JenkinsTraceAnalyzer:
         problematic_traces = self._identify_problematic_traces(traces)
         logger.info(f"⚠️ Identificadas {len(problematic_traces)} trazas problemáticas")
         
-        # Correlacionar con logs
+        # Árbol de spans por traza: qué operaciones marcan realmente la duración de los builds
+        self.latency_drivers, self.critical_paths = rank_latency_drivers(traces.trace_records())
+        
+        # Correlacionar con logs: las ventanas solapadas se consultan una sola vez
+        window_logs = await self.loki.query_logs_around_times(
+            [trace.start_time for trace in problematic_traces],
+            window_minutes=5,
+            namespace="jenkins",
+            deadline=deadline
+        )
+        if deadline is not None and loop.time() >= deadline and problematic_traces:
+            self.incomplete_phases.append("logs de Loki")
+        
+        # Índice por trace ID sobre todos los logs descargados (las ventanas comparten objetos)
+        unique_logs = {id(log): log for logs in window_logs for log in logs}
+        # Con `| json` los campos trace_id/span_id quedan en los labels, no en la línea
+        log_index = TraceLogIndex(unique_logs.values(), labels=itemgetter('labels'))
+        logger.info(f"🔗 {log_index.indexed} de {log_index.scanned} logs llevan trace ID")
+        
+        trace_logs = [log_index.for_trace(trace.trace_id) for trace in problematic_traces]
+        
+        # Análisis por traza (escaneo de palabras clave), en procesos si hay varios trabajadores
+        outcomes = None
+        if self.analysis_workers > 1 and len(problematic_traces) > 1:
+            outcomes = await self._analyze_in_processes(problematic_traces, window_logs, trace_logs)
+        if outcomes is None:
+            outcomes = [
+                (self._analyze_correlation(trace, logs, linked), self._calculate_severity(trace, logs))
+                for trace, logs, linked in zip(problematic_traces, window_logs, trace_logs)
+            ]
+        
         correlated_events = []
-        for trace in problematic_traces:
-            logs = self.loki.query_logs_around_time(
-                timestamp=trace.start_time,
-                window_minutes=5,
-                namespace="jenkins"
-            )
-            
-            analysis = self._analyze_correlation(trace, logs)
-            severity = self._calculate_severity(trace, logs)
-            
+        for trace, logs, linked, (analysis, severity) in zip(problematic_traces, window_logs, trace_logs, outcomes):
             event = CorrelatedEvent(
                 trace=trace,
                 logs=logs,
                 analysis=analysis,
-                severity=severity
+                severity=severity,
+                trace_logs=linked,
+                span_logs=log_index.for_span(trace.trace_id, trace.span_id)
             )
             correlated_events.append(event)
+        
+        # Las baselines se actualizan después de evaluar, para que el incidente no suba su propio umbral.
+        # Con trazas a medias no: la marca de agua dejaría fuera para siempre las que faltan.
+        # Tampoco en modo TraceQL: solo llegan trazas con error o de más de 5s, y los cuantiles
+        # aprendidos de ellas subirían sin límite
+        if traceql is not None:
+            logger.info("📈 Baselines de latencia sin actualizar: la búsqueda TraceQL solo trae trazas problemáticas")
+        elif traces_complete:
+            added = self.baselines.update(traces)
+            self.baselines.save()
+            logger.info(f"📈 Baselines de latencia: {added} spans nuevos en {len(self.baselines.sketches)} operaciones")
             
         return correlated_events
     
-    def _identify_problematic_traces(self, traces: List[TraceSpan]) -> List[TraceSpan]:
+    def _identify_problematic_traces(self, table: SpanTable) -> List[TraceSpan]:
         """Identifica trazas problemáticas (errores, alta latencia)"""
         
-        problematic = []
+        # Criterios para considerar una traza problemática:
+        # 1. Status code de error
+        # 2. Duración por encima del p95 de su operación (5 segundos sin baseline suficiente)
+        # 3. Tags que indican problemas
+        # Se evalúan como máscaras sobre la tabla columnar; cada valor de tag distinto se revisa una vez
+        is_error = table.status_in(['ERROR', 'FAILED', '2'])
+        is_slow = self.baselines.slow_mask(table, self.slow_quantile, 5000000000)
+        has_error_tags = table.any_tag_value(
+            lambda value: 'error' in str(value).lower() or 'fail' in str(value).lower()
+        )
         
-        for trace in traces:
-            # Criterios para considerar una traza problemática:
-            # 1. Status code de error
-            # 2. Duración > 5 segundos (5000000000 nanosegundos)
-            # 3. Tags que indican problemas
-            
-            is_error = trace.status_code in ['ERROR', 'FAILED', '2']
-            is_slow = trace.duration > 5000000000  # 5 segundos
-            has_error_tags = any(
-                'error' in str(value).lower() or 'fail' in str(value).lower()
-                for value in trace.tags.values()
-            )
-            
-            if is_error or is_slow or has_error_tags:
-                problematic.append(trace)
-                
-        return problematic
+        return [TraceSpan(*table.row(i)) for i in table.indices(table.any_of(is_error, is_slow, has_error_tags))]
     
-    def _analyze_correlation(self, trace: TraceSpan, logs: List[Dict[str, Any]]) -> str:
+    def _analyze_correlation(self, trace: TraceSpan, logs: List[Dict[str, Any]],
+                             trace_logs: Optional[List[Dict[str, Any]]] = None) -> str:
         """Analiza la correlación entre una traza y los logs"""
         
-        # Análisis básico de patrones en logs
-        error_logs = [
-            log for log in logs 
-            if any(keyword in log['line'].lower() 
-                  for keyword in ['error', 'exception', 'failed', 'timeout'])
-        ]
-        
-        warning_logs = [
-            log for log in logs 
-            if any(keyword in log['line'].lower() 
-                  for keyword in ['warning', 'warn', 'retry'])
-        ]
-        
-        analysis_parts = []
-        
-        # Información de la traza
-        duration_ms = trace.duration / 1000000  # Convertir a milisegundos
-        analysis_parts.append(f"Traza {trace.operation_name} duró {duration_ms:.2f}ms")
-        
-        if trace.status_code in ['ERROR', 'FAILED', '2']:
-            analysis_parts.append(f"Estado: {trace.status_code}")
+        return correlation_summary(trace.operation_name, trace.duration, trace.status_code,
+                                   [log['line'] for log in logs], len(trace_logs or []))
+    
+    def _calculate_severity(self, trace: TraceSpan, logs: List[Dict[str, Any]]) -> str:
+        """Calcula la severidad de un evento"""
         
-        # Análisis de logs correlacionados
-        if error_logs:
-            analysis_parts.append(f"🔴 {len(error_logs)} logs de error encontrados")
-            # Mostrar el primer error
-            if error_logs:
-                first_error = error_logs[0]['line'][:200]
-                analysis_parts.append(f"Primer error: {first_error}")
+        return severity_level(trace.status_code, trace.duration, self._duration_thresholds(trace),
+                              [log['line'] for log in logs])
+    
+    async def _analyze_in_processes(self, traces: List[TraceSpan], window_logs: List[List[Dict[str, Any]]],
+                                    trace_logs: List[List[Dict[str, Any]]]) -> Optional[List[Tuple[str, str]]]:
+        """(análisis, severidad) de cada traza, repartidas por bloques entre procesos; None si el pool falla
+
+        Cada bloque viaja serializado con _pack_chunk y los resultados vuelven en el orden
+        de las trazas, idénticos a los del análisis en serie.
+        """
         
-        if warning_logs:
-            analysis_parts.append(f"🟡 {len(warning_logs)} warnings encontrados")
+        items = [
+            (trace, logs, self._duration_thresholds(trace), len(linked))
+            for trace, logs, linked in zip(traces, window_logs, trace_logs)
+        ]
+        # Varios bloques por proceso para repartir bien trazas con ventanas de tamaño desigual
+        size = -(-len(items) // (self.analysis_workers * 4))
+        chunks = [_pack_chunk(items[i:i + size]) for i in range(0, len(items), size)]
         
-        # Análisis de patrones temporales
-        if len(logs) > 10:
-            analysis_parts.append(f"📊 Alta actividad: {len(logs)} logs en ventana de 10min")
+        loop = asyncio.get_running_loop()
+        try:
+            with ProcessPoolExecutor(max_workers=self.analysis_workers) as pool:
+                results = await asyncio.gather(*[loop.run_in_executor(pool, _analyze_chunk, chunk) for chunk in chunks])
+        except (OSError, BrokenProcessPool) as e:
+            logger.warning(f"Pool de procesos no disponible ({e}); se analiza en serie")
+            return None
         
-        return " | ".join(analysis_parts) if analysis_parts else "Sin patrones significativos detectados"
+        return [outcome for chunk_results in results for outcome in chunk_results]
     
-    def _calculate_severity(self, trace: TraceSpan, logs: List[Dict[str, Any]]) -> str:
-        """Calcula la severidad de un evento"""
-        
-        score = 0
-        
-        # Puntuación por estado de traza
-        if trace.status_code in ['ERROR', 'FAILED', '2']:
-            score += 3
-        
-        # Puntuación por duración
-        duration_seconds = trace.duration / 1000000000
-        if duration_seconds > 10:
-            score += 3
-        elif duration_seconds > 5:
-            score += 2
-        elif duration_seconds > 2:
-            score += 1
-        
-        # Puntuación por logs de error
-        error_count = sum(
-            1 for log in logs 
-            if any(keyword in log['line'].lower() 
-                  for keyword in ['error', 'exception', 'failed'])
-        )
-        score += min(error_count, 3)
-        
-        # Clasificación final
-        if score >= 6:
-            return "CRITICAL"
-        elif score >= 4:
-            return "HIGH"
-        elif score >= 2:
-            return "MEDIUM"
-        else:
-            return "LOW"
+    def _duration_thresholds(self, trace: TraceSpan) -> Tuple[float, float, float]:
+        """Umbrales (crítico, lento, elevado) en nanosegundos: p99/p95/p90 de la operación o 10s/5s/2s"""
+        thresholds = [
+            self.baselines.threshold(trace.service_name, trace.operation_name, q)
+            for q in (self.critical_quantile, self.slow_quantile, self.elevated_quantile)
+        ]
+        if None in thresholds:
+            return 10000000000, 5000000000, 2000000000
+        return tuple(thresholds)
     
     def generate_report(self, events: List[CorrelatedEvent]) -> str:
         """Genera un reporte detallado de los eventos correlacionados"""
@@ -368,6 +901,10 @@ class JenkinsTraceAnalyzer:
         report_lines.append("=" * 80)
         report_lines.append(f"Fecha: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
         report_lines.append(f"Eventos analizados: {len(events)}")
+        if self.incomplete_phases:
+            report_lines.append(
+                f"⏱️ Análisis parcial: límite de {self.time_budget:g}s alcanzado ({', '.join(self.incomplete_phases)})"
+            )
         report_lines.append("")
         
         # Resumen por severidad
@@ -399,13 +936,24 @@ class JenkinsTraceAnalyzer:
                 report_lines.append(f"   Servicio: {event.trace.service_name}")
                 report_lines.append(f"   Trace ID: {event.trace.trace_id}")
                 report_lines.append(f"   Análisis: {event.analysis}")
+                
+                critical_path = self.critical_paths.get(event.trace.trace_id)
+                if critical_path:
+                    steps = ", ".join(
+                        f"{operation} ({contribution / 1000000000:.1f}s)"
+                        for (_, operation), contribution in critical_path[:3]
+                    )
+                    report_lines.append(f"   Ruta crítica: {steps}")
                 report_lines.append(f"   Logs correlacionados: {len(event.logs)}")
+                if event.trace_logs:
+                    report_lines.append(
+                        f"   Logs con el trace ID: {len(event.trace_logs)} ({len(event.span_logs)} de este span)"
+                    )
                 
                 # Mostrar algunos logs relevantes
                 error_logs = [
                     log for log in event.logs[:5] 
-                    if any(keyword in log['line'].lower() 
-                          for keyword in ['error', 'exception', 'failed'])
+                    if LOG_KEYWORDS.has(log['line'], 'error')
                 ]
                 if error_logs:
                     report_lines.append("   Logs de error:")
@@ -415,6 +963,20 @@ class JenkinsTraceAnalyzer:
                 
                 report_lines.append("")
         
+        # Operaciones que dominan la latencia de extremo a extremo
+        if self.latency_drivers:
+            report_lines.append("OPERACIONES EN LA RUTA CRÍTICA:")
+            report_lines.append("-" * 50)
+            for i, driver in enumerate(self.latency_drivers[:10], 1):
+                report_lines.append(
+                    f"{i}. {driver['service']}/{driver['operation']}: "
+                    f"{driver['critical_path_ns'] / 1000000000:.1f}s en ruta crítica "
+                    f"({driver['critical_path_share']:.0%}), "
+                    f"self-time {driver['self_time_ns'] / 1000000000:.1f}s, "
+                    f"{driver['traces']} trazas"
+                )
+            report_lines.append("")
+        
         # Recomendaciones
         report_lines.append("RECOMENDACIONES:")
         report_lines.append("-" * 20)
@@ -476,8 +476,12 @@ if __name__ == "__main__":
     except Exception as e:
         logger.error(f"❌ Error durante el análisis: {e}")
         raise
+import os
+import sys
 import json
 import asyncio
+import time
+import statistics
 import aiohttp
 import requests
 import pandas as pd
@@ -485,6 +489,19 @@ from datetime import datetime, timedelta
 from typing import Dict, List, Any, Optional
 from dotenv import load_dotenv
 
+# Clasificador de palabras clave compartido con observability-python
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'observability-python'))
+from log_classifier import KeywordClassifier
+from log_records import LogRecord, stream_labels
+from trace_cache import TraceCache
+from trace_log_index import TraceLogIndex
+
+SEVERITY_KEYWORDS = KeywordClassifier([
+    ('CRITICAL', ['fatal', 'critical', 'severe']),
+    ('ERROR', ['error', 'exception', 'failed']),
+    ('WARNING', ['warning', 'warn'])
+], default='INFO')
+
 class JenkinsTraceAnalyzer:
     """Analyze Jenkins traces and correlate with pod failures"""
     
@@ -499,10 +516,15 @@ class JenkinsTraceAnalyzer:
         
         # Analysis configuration
         self.analysis_hours = int(os.getenv("ANALYSIS_HISTORY_HOURS", 2))
+        self.trace_log_limit = int(os.getenv("TRACE_LOG_PREFETCH_LIMIT", 5000))
         self.output_dir = os.getenv("OUTPUT_DIR", "./trace-analysis")
         
         # Ensure output directory exists
         os.makedirs(self.output_dir, exist_ok=True)
+        
+        # Completed traces never change: keep them across runs
+        self.trace_cache = TraceCache.from_env()
+        self.cache_min_age_ns = int(float(os.getenv("TRACE_CACHE_MIN_AGE_SECONDS", 300)) * 1_000_000_000)
 
     async def get_jenkins_traces(self, time_range_hours: int = 2) -> List[Dict]:
         """Fetch Jenkins-related traces from Tempo"""
@@ -535,6 +557,16 @@ class JenkinsTraceAnalyzer:
     async def get_trace_details(self, trace_id: str) -> Dict:
         """Get detailed trace information including spans"""
         
+        if self.trace_cache:
+            details = await self.trace_cache.get_or_fetch_async(
+                trace_id, lambda: self._download_trace(trace_id), cacheable=self._is_finished
+            )
+            return details or {}
+        return await self._download_trace(trace_id) or {}
+
+    async def _download_trace(self, trace_id: str) -> Optional[Dict]:
+        """Fetch a trace from Tempo; None on failure"""
+        
         try:
             async with aiohttp.ClientSession() as session:
                 async with session.get(f"{self.tempo_endpoint}/api/traces/{trace_id}") as response:
@@ -543,22 +575,24 @@ class JenkinsTraceAnalyzer:
         except Exception as e:
             print(f"Error fetching trace details for {trace_id}: {e}")
             
-        return {}
+        return None
 
-    async def correlate_trace_with_logs(self, trace_id: str, time_range_minutes: int = 30) -> List[Dict]:
-        """Correlate trace with corresponding logs from Jenkins master and pods"""
-        
-        # Get trace details first
-        trace_details = await self.get_trace_details(trace_id)
-        
-        if not trace_details:
-            return []
-            
-        # Extract time range from trace
-        spans = trace_details.get('batches', [{}])[0].get('resource_spans', [{}])[0].get('scope_spans', [{}])[0].get('spans', [])
+    @staticmethod
+    def _trace_spans(trace_details: Dict) -> List[Dict]:
+        """Spans of the first resource/scope of a trace"""
+        return trace_details.get('batches', [{}])[0].get('resource_spans', [{}])[0].get('scope_spans', [{}])[0].get('spans', [])
+
+    def _is_finished(self, trace_details: Dict) -> bool:
+        """Only cache traces whose last span ended more than TRACE_CACHE_MIN_AGE_SECONDS ago"""
+        end_times = [int(span.get('end_time_unix_nano', 0)) for span in self._trace_spans(trace_details)]
+        return bool(end_times) and time.time_ns() - max(end_times) > self.cache_min_age_ns
+
+    def _trace_window(self, trace_details: Dict, time_range_minutes: int = 30) -> Optional[tuple]:
+        """Log window (start, end) around a trace's spans; None if it has no spans"""
+        spans = self._trace_spans(trace_details) if trace_details else []
         
         if not spans:
-            return []
+            return None
             
         # Get start and end times from spans
         start_times = [int(span.get('start_time_unix_nano', 0)) / 1_000_000_000 for span in spans]
@@ -566,6 +600,63 @@ class JenkinsTraceAnalyzer:
         
         trace_start = datetime.fromtimestamp(min(start_times)) - timedelta(minutes=time_range_minutes//2)
         trace_end = datetime.fromtimestamp(max(end_times)) + timedelta(minutes=time_range_minutes//2)
+        return trace_start, trace_end
+
+    async def fetch_trace_log_index(self, start: datetime, end: datetime) -> Optional[TraceLogIndex]:
+        """One bulk fetch of Jenkins master lines carrying trace IDs, indexed by trace ID"""
+        
+        params = {
+            'query': '{namespace="jenkins-master"} |~ "(?i)(trace.?id|[0-9a-f]{2}-[0-9a-f]{32}-[0-9a-f]{16}-[0-9a-f]{2})"',
+            'start': int(start.timestamp() * 1_000_000_000),
+            'end': int(end.timestamp() * 1_000_000_000),
+            'limit': self.trace_log_limit,
+            'direction': 'backward'
+        }
+        
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.get(f"{self.loki_endpoint}/loki/api/v1/query_range", params=params) as response:
+                    if response.status != 200:
+                        return None
+                    data = await response.json()
+        except Exception as e:
+            print(f"Error fetching trace ID logs: {e}")
+            return None
+        
+        logs = []
+        for stream in data.get('data', {}).get('result', []):
+            namespace, pod, container, node = stream_labels(
+                stream.get('stream', {}), 'namespace', 'kubernetes_pod_name', 'kubernetes_container_name', 'kubernetes_node_name'
+            )
+            for timestamp, log_line in stream.get('values', []):
+                logs.append(LogRecord(int(timestamp), namespace, pod, container, log_line, 0, node=node))
+        
+        if len(logs) >= self.trace_log_limit:
+            # Older lines were cut off: traces there still get their own query
+            print(f"Trace ID log prefetch hit its limit of {self.trace_log_limit} lines")
+            return None
+        return TraceLogIndex(logs, line=lambda log: log.log_line)
+
+    async def correlate_trace_with_logs(self, trace_id: str, time_range_minutes: int = 30,
+                                        trace_details: Optional[Dict] = None,
+                                        log_index: Optional[TraceLogIndex] = None) -> List[LogRecord]:
+        """Correlate trace with corresponding logs from Jenkins master and pods
+        
+        With a log_index, the logs carrying this trace ID are joined from it instead of
+        being queried from Loki.
+        """
+        
+        # Get trace details first, unless the caller already has them
+        if trace_details is None:
+            trace_details = await self.get_trace_details(trace_id)
+        
+        # Extract time range from trace
+        window = self._trace_window(trace_details, time_range_minutes)
+        
+        if window is None:
+            return []
+        
+        trace_start, trace_end = window
         
         # Query Loki for correlated logs
         log_queries = [
@@ -584,7 +675,12 @@ class JenkinsTraceAnalyzer:
         
         all_logs = []
         
-        for query in log_queries:
+        if log_index is not None:
+            all_logs.extend(log_index.for_trace(trace_id))
+        
+        for query_id, query in enumerate(log_queries):
+            if query_id == 0 and log_index is not None:
+                continue  # Already joined by trace ID
             try:
                 params = {
                     'query': query,
@@ -603,26 +699,21 @@ class JenkinsTraceAnalyzer:
                             for stream in results:
                                 labels = stream.get('stream', {})
                                 values = stream.get('values', [])
+                                namespace, pod, container, node = stream_labels(
+                                    labels, 'namespace', 'kubernetes_pod_name', 'kubernetes_container_name', 'kubernetes_node_name'
+                                )
                                 
                                 for timestamp, log_line in values:
-                                    all_logs.append({
-                                        'timestamp': datetime.fromtimestamp(int(timestamp) / 1_000_000_000),
-                                        'trace_id': trace_id,
-                                        'namespace': labels.get('namespace', 'unknown'),
-                                        'pod': labels.get('kubernetes_pod_name', 'unknown'),
-                                        'container': labels.get('kubernetes_container_name', 'unknown'),
-                                        'node': labels.get('kubernetes_node_name', 'unknown'),
-                                        'log_line': log_line,
-                                        'query_used': query
-                                    })
+                                    all_logs.append(LogRecord(int(timestamp), namespace, pod, container, log_line,
+                                                              query_id, node=node))
                             
             except Exception as e:
                 print(f"Error querying logs for trace {trace_id}: {e}")
                 continue
                 
-        return sorted(all_logs, key=lambda x: x['timestamp'])
+        return sorted(all_logs, key=lambda x: x.timestamp_ns)
 
-    def analyze_jenkins_failure_pattern(self, trace_data: Dict, correlated_logs: List[Dict]) -> Dict:
+    def analyze_jenkins_failure_pattern(self, trace_data: Dict, correlated_logs: List[LogRecord]) -> Dict:
         """Analyze failure patterns between Jenkins master and pods"""
         
         analysis = {
@@ -632,6 +723,7 @@ class JenkinsTraceAnalyzer:
             'master_issues': [],
             'spot_worker_events': [],
             'timeline': [],
+            'time_correlation': None,
             'recommendations': []
         }
         
@@ -659,47 +751,55 @@ class JenkinsTraceAnalyzer:
         
         # Analyze correlated logs
         for log in correlated_logs:
-            log_line = log['log_line'].lower()
+            log_line = log.log_line.lower()
+            timestamp = log.timestamp
             
             # Categorize issues
-            if log['namespace'] == 'jenkins-master':
+            if log.namespace == 'jenkins-master':
                 if any(keyword in log_line for keyword in ['error', 'exception', 'failed']):
                     analysis['master_issues'].append({
-                        'timestamp': log['timestamp'],
-                        'pod': log['pod'],
-                        'message': log['log_line'][:200],
-                        'severity': self._determine_severity(log['log_line'])
+                        'timestamp': timestamp,
+                        'pod': log.pod,
+                        'message': log.log_line[:200],
+                        'severity': self._determine_severity(log.log_line)
                     })
                     
-            elif log['namespace'] == 'jenkins-workers':
+            elif log.namespace == 'jenkins-workers':
                 if any(keyword in log_line for keyword in ['error', 'exception', 'failed']):
                     analysis['pod_issues'].append({
-                        'timestamp': log['timestamp'],
-                        'pod': log['pod'],
-                        'node': log['node'],
-                        'message': log['log_line'][:200],
-                        'is_spot_worker': 'spot' in log['node'].lower()
+                        'timestamp': timestamp,
+                        'pod': log.pod,
+                        'node': log.node,
+                        'message': log.log_line[:200],
+                        'is_spot_worker': 'spot' in log.node.lower()
                     })
                     
                 # Spot worker specific events
-                if 'spot' in log['node'].lower() and any(keyword in log_line for keyword in ['evicted', 'preempted', 'terminated']):
+                if 'spot' in log.node.lower() and any(keyword in log_line for keyword in ['evicted', 'preempted', 'terminated']):
                     analysis['spot_worker_events'].append({
-                        'timestamp': log['timestamp'],
-                        'pod': log['pod'],
-                        'node': log['node'],
-                        'event': log['log_line'][:200]
+                        'timestamp': timestamp,
+                        'pod': log.pod,
+                        'node': log.node,
+                        'event': log.log_line[:200]
                     })
             
             # Build timeline
             analysis['timeline'].append({
-                'timestamp': log['timestamp'],
-                'source': f"{log['namespace']}/{log['pod']}",
-                'event': log['log_line'][:100]
+                'timestamp': timestamp,
+                'source': f"{log.namespace}/{log.pod}",
+                'event': log.log_line[:100]
             })
         
         # Sort timeline
         analysis['timeline'] = sorted(analysis['timeline'], key=lambda x: x['timestamp'])
         
+        # Match master issues with the pod issues around them
+        if analysis['master_issues'] and analysis['pod_issues']:
+            analysis['time_correlation'] = self._check_time_correlation(
+                analysis['master_issues'],
+                analysis['pod_issues']
+            )
+        
         # Generate recommendations
         analysis['recommendations'] = self._generate_recommendations(analysis)
         
@@ -707,16 +807,7 @@ class JenkinsTraceAnalyzer:
 
     def _determine_severity(self, log_line: str) -> str:
         """Determine log severity"""
-        log_lower = log_line.lower()
-        
-        if any(keyword in log_lower for keyword in ['fatal', 'critical', 'severe']):
-            return 'CRITICAL'
-        elif any(keyword in log_lower for keyword in ['error', 'exception', 'failed']):
-            return 'ERROR'
-        elif any(keyword in log_lower for keyword in ['warning', 'warn']):
-            return 'WARNING'
-        else:
-            return 'INFO'
+        return SEVERITY_KEYWORDS.classify(log_line)
 
     def _generate_recommendations(self, analysis: Dict) -> List[str]:
         """Generate recommendations based on analysis"""
@@ -730,17 +821,13 @@ class JenkinsTraceAnalyzer:
             )
             
         # Check for master-pod communication issues
-        if analysis['master_issues'] and analysis['pod_issues']:
-            time_correlation = self._check_time_correlation(
-                analysis['master_issues'], 
-                analysis['pod_issues']
+        time_correlation = analysis.get('time_correlation')
+        if time_correlation and time_correlation['pairs']:
+            recommendations.append(
+                "🔗 Master-Pod Communication Issue: Investigate network connectivity "
+                "between Jenkins master and workers, check for DNS resolution issues"
             )
-            if time_correlation:
-                recommendations.append(
-                    "🔗 Master-Pod Communication Issue: Investigate network connectivity "
-                    "between Jenkins master and workers, check for DNS resolution issues"
-                )
-                
+            
         # Check for resource issues
         pod_issues_text = ' '.join([issue['message'] for issue in analysis['pod_issues']])
         if any(keyword in pod_issues_text.lower() for keyword in ['memory', 'cpu', 'resource']):
@@ -759,20 +846,59 @@ class JenkinsTraceAnalyzer:
         return recommendations
 
     def _check_time_correlation(self, master_issues: List, pod_issues: List, 
-                               correlation_window_seconds: int = 300) -> bool:
-        """Check if master and pod issues are correlated in time"""
-        
-        for master_issue in master_issues:
-            master_time = master_issue['timestamp']
+                               correlation_window_seconds: int = 300) -> Dict[str, Any]:
+        """Pair each master issue with the nearest pod issue within the window, in O(n + m)
+        
+        Returns the matched pairs (master index, pod index, lag in seconds) and lag
+        statistics. A positive lag means the pod issue came first.
+        """
+        
+        # Issues come from time-ordered logs, so these sorts are linear in practice
+        master_order = sorted(range(len(master_issues)), key=lambda i: master_issues[i]['timestamp'])
+        pod_order = sorted(range(len(pod_issues)), key=lambda i: pod_issues[i]['timestamp'])
+        pod_times = [pod_issues[i]['timestamp'] for i in pod_order]
+        
+        pairs = []
+        j = 0
+        for i in master_order:
+            master_time = master_issues[i]['timestamp']
             
-            for pod_issue in pod_issues:
-                pod_time = pod_issue['timestamp']
-                time_diff = abs((master_time - pod_time).total_seconds())
-                
-                if time_diff <= correlation_window_seconds:
-                    return True
-                    
-        return False
+            # Advance to the last pod issue at or before this master issue
+            while j + 1 < len(pod_times) and pod_times[j + 1] <= master_time:
+                j += 1
+            
+            # The nearest pod issue is either that one or the next one
+            candidates = [k for k in (j, j + 1) if k < len(pod_times)]
+            nearest = min(candidates, key=lambda k: abs((master_time - pod_times[k]).total_seconds()))
+            lag = (master_time - pod_times[nearest]).total_seconds()
+            
+            if abs(lag) <= correlation_window_seconds:
+                pairs.append((i, pod_order[nearest], lag))
+        
+        lags = [lag for _, _, lag in pairs]
+        return {
+            'pairs': pairs,
+            'lag_seconds': {
+                'median': statistics.median(lags),
+                'mean': statistics.fmean(lags),
+                'min': min(lags),
+                'max': max(lags)
+            } if lags else None
+        }
+
+    @staticmethod
+    def _describe_time_correlation(time_correlation: Optional[Dict[str, Any]]) -> Optional[str]:
+        """One-line summary such as "pod errors lead master errors by ~40s" """
+        if not time_correlation or not time_correlation['pairs']:
+            return None
+        
+        median = time_correlation['lag_seconds']['median']
+        pairs = len(time_correlation['pairs'])
+        matched = f"{pairs} matched pair{'s' if pairs != 1 else ''}"
+        if abs(median) < 1:
+            return f"pod and master errors occur together ({matched})"
+        leader, follower = ('pod', 'master') if median > 0 else ('master', 'pod')
+        return f"{leader} errors lead {follower} errors by ~{abs(median):.0f}s ({matched})"
 
     async def generate_trace_analysis_report(self, traces: List[Dict]) -> str:
         """Generate comprehensive trace analysis report"""
@@ -794,16 +920,27 @@ class JenkinsTraceAnalyzer:
         # Analyze all traces
         all_analyses = []
         
+        # Get detailed traces first, so the logs carrying their IDs can be fetched in one go
+        details = {}
         for trace in traces:
             trace_id = trace.get('traceID', '')
             if trace_id:
-                # Get detailed trace and correlate with logs
-                trace_details = await self.get_trace_details(trace_id)
-                correlated_logs = await self.correlate_trace_with_logs(trace_id)
-                
-                # Analyze this specific trace
-                analysis = self.analyze_jenkins_failure_pattern(trace_details, correlated_logs)
-                all_analyses.append(analysis)
+                details[trace_id] = await self.get_trace_details(trace_id)
+        
+        windows = [window for window in map(self._trace_window, details.values()) if window]
+        log_index = None
+        if windows:
+            log_index = await self.fetch_trace_log_index(min(w[0] for w in windows), max(w[1] for w in windows))
+        
+        for trace_id, trace_details in details.items():
+            # Correlate with logs
+            correlated_logs = await self.correlate_trace_with_logs(
+                trace_id, trace_details=trace_details, log_index=log_index
+            )
+            
+            # Analyze this specific trace
+            analysis = self.analyze_jenkins_failure_pattern(trace_details, correlated_logs)
+            all_analyses.append(analysis)
         
         # Summary statistics
         total_failures = sum(len(analysis['failure_indicators']) for analysis in all_analyses)
@@ -836,7 +973,13 @@ class JenkinsTraceAnalyzer:
 **Master Issues:** {len(analysis['master_issues'])}  
 **Pod Issues:** {len(analysis['pod_issues'])}  
 **Spot Worker Events:** {len(analysis['spot_worker_events'])}
-
+"""
+            
+            correlation_summary = self._describe_time_correlation(analysis['time_correlation'])
+            if correlation_summary:
+                report += f"**Time Correlation:** {correlation_summary}\n"
+            
+            report += """
 #### Timeline of Events:
 """
             
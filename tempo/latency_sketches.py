@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+Umbrales de Latencia por Operación
+==================================
+
+Cada operación de Jenkins tiene su propia latencia normal: un sondeo SCM
+tarda milisegundos y un build completo minutos. En lugar de cortes fijos,
+se mantiene un sketch de cuantiles por (servicio, operación) y un span es
+lento cuando supera el p95/p99 de su propia operación.
+
+Los sketches siguen el esquema de DDSketch: buckets logarítmicos con error
+relativo acotado, fusionables y con un número máximo de buckets (memoria
+constante por operación). Se guardan en un fichero JSON entre ejecuciones.
+
+Dependencia opcional:
+- numpy: agrupa y añade los spans de una tabla de forma vectorizada.
+"""
+
+import json
+import logging
+import math
+import os
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # Opcional: se añaden los valores uno a uno
+    np = None
+
+logger = logging.getLogger(__name__)
+
+
+class DDSketch:
+    """Sketch de cuantiles con error relativo acotado"""
+
+    def __init__(self, relative_accuracy: float = 0.01, max_bins: int = 2048):
+        self.relative_accuracy = relative_accuracy
+        self.max_bins = max_bins
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.multiplier = 1 / math.log(self.gamma)
+        self.bins: Dict[int, int] = {}
+        self.zero_count = 0
+        self.count = 0
+
+    def _key(self, value: float) -> int:
+        return math.ceil(math.log(value) * self.multiplier)
+
+    def _upper(self, key: int) -> float:
+        return self.gamma ** key
+
+    def _value(self, key: int) -> float:
+        # Punto medio del bucket (gamma^(key-1), gamma^key] en escala relativa
+        return 2 * self.gamma ** key / (self.gamma + 1)
+
+    def add(self, value: float, count: int = 1) -> None:
+        if value <= 0:
+            self.zero_count += count
+        else:
+            key = self._key(value)
+            self.bins[key] = self.bins.get(key, 0) + count
+        self.count += count
+        self._collapse()
+
+    def add_many(self, values) -> None:
+        """Añade muchos valores de una vez (array de NumPy o iterable)"""
+        if np is None:
+            for value in values:
+                self.add(value)
+            return
+
+        values = np.asarray(values, dtype=np.float64)
+        positive = values[values > 0]
+        self.zero_count += len(values) - len(positive)
+        self.count += len(values)
+        keys, counts = np.unique(np.ceil(np.log(positive) * self.multiplier).astype(np.int64), return_counts=True)
+        for key, count in zip(keys.tolist(), counts.tolist()):
+            self.bins[key] = self.bins.get(key, 0) + count
+        self._collapse()
+
+    def merge(self, other: 'DDSketch') -> None:
+        """Suma los recuentos de otro sketch con la misma precisión"""
+        for key, count in other.bins.items():
+            self.bins[key] = self.bins.get(key, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self._collapse()
+
+    def _collapse(self) -> None:
+        """Junta los buckets más bajos para no pasar de max_bins (se pierde precisión en los valores pequeños)"""
+        if len(self.bins) <= self.max_bins:
+            return
+        keys = sorted(self.bins)
+        excess = len(keys) - self.max_bins
+        target = keys[excess]
+        for key in keys[:excess]:
+            self.bins[target] += self.bins.pop(key)
+
+    def quantile(self, q: float, upper_bound: bool = False) -> Optional[float]:
+        """Valor aproximado del cuantil q (0-1), o el límite superior de su bucket; None si está vacío"""
+        if self.count == 0:
+            return None
+
+        rank = q * (self.count - 1)
+        if rank < self.zero_count:
+            return 0.0
+
+        value = self._upper if upper_bound else self._value
+        seen = self.zero_count
+        for key in sorted(self.bins):
+            seen += self.bins[key]
+            if seen > rank:
+                return value(key)
+        return value(max(self.bins))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'relative_accuracy': self.relative_accuracy,
+            'max_bins': self.max_bins,
+            'zero_count': self.zero_count,
+            'bins': {str(key): count for key, count in self.bins.items()}
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'DDSketch':
+        sketch = cls(data['relative_accuracy'], data['max_bins'])
+        sketch.zero_count = data['zero_count']
+        sketch.bins = {int(key): count for key, count in data['bins'].items()}
+        sketch.count = sketch.zero_count + sum(sketch.bins.values())
+        return sketch
+
+
+class LatencyBaselines:
+    """Sketches de duración por (servicio, operación), persistidos en JSON"""
+
+    def __init__(self, path: str, min_samples: int = 50, relative_accuracy: float = 0.01,
+                 max_bins: int = 2048):
+        self.path = path
+        self.min_samples = min_samples
+        self.relative_accuracy = relative_accuracy
+        self.max_bins = max_bins
+        self.sketches: Dict[Tuple[str, str], DDSketch] = {}
+        # Inicio del span más reciente ya incorporado: las ventanas solapadas no cuentan dos veces
+        self.watermark_ns = 0
+        self._load()
+
+    @classmethod
+    def from_env(cls) -> 'LatencyBaselines':
+        """Baselines configuradas con LATENCY_BASELINE_*"""
+        return cls(
+            path=os.getenv("LATENCY_BASELINE_PATH", ".latency_baselines.json"),
+            min_samples=int(os.getenv("LATENCY_BASELINE_MIN_SAMPLES", 50)),
+            relative_accuracy=float(os.getenv("LATENCY_BASELINE_ACCURACY", 0.01))
+        )
+
+    def _load(self) -> None:
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self.watermark_ns = data.get('watermark_ns', 0)
+            for entry in data.get('operations', []):
+                self.sketches[(entry['service'], entry['operation'])] = DDSketch.from_dict(entry['sketch'])
+        except (OSError, ValueError, KeyError) as e:
+            if not isinstance(e, FileNotFoundError):
+                logger.warning(f"No se pudieron cargar las baselines de latencia de {self.path}: {e}")
+
+    def save(self) -> None:
+        data = {
+            'watermark_ns': self.watermark_ns,
+            'operations': [
+                {'service': service, 'operation': operation, 'sketch': sketch.to_dict()}
+                for (service, operation), sketch in self.sketches.items()
+            ]
+        }
+        # Escribir y renombrar: un fallo nunca deja el fichero a medias
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning(f"No se pudieron guardar las baselines de latencia: {e}")
+
+    def threshold(self, service: str, operation: str, q: float) -> Optional[float]:
+        """Umbral del cuantil q de la operación; None si aún no hay min_samples"""
+        sketch = self.sketches.get((service, operation))
+        if sketch is None or sketch.count < self.min_samples:
+            return None
+        # Límite superior del bucket: solo es lento lo que cae en un bucket más alto,
+        # así el error del sketch no marca como lentas duraciones idénticas al cuantil
+        return sketch.quantile(q, upper_bound=True)
+
+    def _groups(self, table) -> Iterable[Tuple[Tuple[str, str], Any]]:
+        """(servicio, operación) y posiciones de sus spans en la tabla"""
+        if np is not None:
+            combo = table.service.astype(np.int64) * len(table.operations) + table.operation
+            order = np.argsort(combo, kind='stable')
+            ids, starts = np.unique(combo[order], return_index=True)
+            for combo_id, positions in zip(ids.tolist(), np.split(order, starts[1:])):
+                service, operation = divmod(combo_id, len(table.operations))
+                yield (table.services[service], table.operations[operation]), positions
+            return
+
+        groups: Dict[Tuple[int, int], List[int]] = {}
+        for i, key in enumerate(zip(table.service, table.operation)):
+            groups.setdefault(key, []).append(i)
+        for (service, operation), positions in groups.items():
+            yield (table.services[service], table.operations[operation]), positions
+
+    def slow_mask(self, table, q: float, default_ns: int):
+        """Máscara de spans que superan el cuantil q de su operación (default_ns si no hay baseline)"""
+        if np is not None:
+            thresholds = np.full(len(table), default_ns, dtype=np.float64)
+            for key, positions in self._groups(table):
+                baseline = self.threshold(*key, q)
+                if baseline is not None:
+                    thresholds[positions] = baseline
+            return table.duration > thresholds
+
+        mask = [False] * len(table)
+        for key, positions in self._groups(table):
+            baseline = self.threshold(*key, q)
+            limit = default_ns if baseline is None else baseline
+            for i in positions:
+                mask[i] = table.duration[i] > limit
+        return mask
+
+    def update(self, table) -> int:
+        """Incorpora los spans posteriores a la marca de agua; devuelve cuántos"""
+        watermark = self.watermark_ns
+        added = 0
+        for key, positions in self._groups(table):
+            if np is not None:
+                fresh = positions[table.start[positions] > watermark]
+                durations = table.duration[fresh]
+            else:
+                fresh = [i for i in positions if table.start[i] > watermark]
+                durations = [table.duration[i] for i in fresh]
+            if len(fresh) == 0:
+                continue
+
+            sketch = self.sketches.get(key)
+            if sketch is None:
+                sketch = self.sketches[key] = DDSketch(self.relative_accuracy, self.max_bins)
+            sketch.add_many(durations)
+            added += len(fresh)
+
+        if len(table):
+            newest = table.start.max() if np is not None else max(table.start)
+            self.watermark_ns = max(watermark, int(newest))
+        return added
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Trazas en Formato OTLP
+======================
+
+Decodificación de trazas de Tempo en protobuf (OTLP). Tempo devuelve
+`tempopb.Trace`, que en el cable es idéntico a `TracesData` de OTLP, así que
+se decodifica con las clases de `opentelemetry-proto` y cada span se
+convierte directamente en un registro compacto en una sola pasada, con el
+`service.name` del recurso como valor por defecto.
+
+Dependencia opcional:
+- opentelemetry-proto: sin ella `HAS_OTLP` es False y el cliente sigue
+  pidiendo la representación JSON.
+"""
+
+from typing import Any, Dict, List, Tuple
+
+try:
+    from opentelemetry.proto.trace.v1 import trace_pb2
+except ImportError:  # Opcional: se usa la ruta JSON
+    trace_pb2 = None
+
+HAS_OTLP = trace_pb2 is not None
+
+PROTOBUF_CONTENT_TYPE = "application/protobuf"
+
+# Status.code de OTLP (UNSET, OK, ERROR) con los valores de otel.status_code en JSON
+_STATUS_CODES = {0: 'unset', 1: 'OK', 2: 'ERROR'}
+
+# (span_id, service_name, operation_name, start_time, duration, status_code, tags, parent_span_id)
+SpanRecord = Tuple[str, str, str, int, int, str, Dict[str, Any], str]
+
+
+def _attribute_value(value) -> Any:
+    """Valor de un AnyValue (texto, entero o booleano, como los tags JSON); None para el resto"""
+    kind = value.WhichOneof('value')
+    if kind == 'string_value':
+        return value.string_value
+    if kind == 'int_value':
+        return value.int_value
+    if kind == 'bool_value':
+        return value.bool_value
+    return None
+
+
+def decode_trace(data: bytes) -> List[SpanRecord]:
+    """Registros de todos los spans de una traza OTLP en protobuf"""
+    if trace_pb2 is None:
+        raise RuntimeError("opentelemetry-proto no está instalado")
+
+    trace = trace_pb2.TracesData()
+    trace.ParseFromString(data)
+
+    records: List[SpanRecord] = []
+    for resource_spans in trace.resource_spans:
+        resource_service = 'unknown'
+        for attribute in resource_spans.resource.attributes:
+            if attribute.key == 'service.name':
+                resource_service = attribute.value.string_value
+                break
+
+        for scope_spans in resource_spans.scope_spans:
+            for span in scope_spans.spans:
+                tags = {}
+                for attribute in span.attributes:
+                    value = _attribute_value(attribute.value)
+                    if value is not None:
+                        tags[attribute.key] = value
+
+                records.append((
+                    span.span_id.hex(),
+                    tags.get('service.name', resource_service),
+                    span.name,
+                    span.start_time_unix_nano,
+                    span.end_time_unix_nano - span.start_time_unix_nano,
+                    _STATUS_CODES.get(span.status.code, 'unset'),
+                    tags,
+                    span.parent_span_id.hex()
+                ))
+
+    return records
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Tabla Columnar de Spans
+=======================
+
+Representación por columnas de todos los spans de una búsqueda, para
+detectar problemas con máscaras vectorizadas en lugar de crear un objeto y
+recorrer sus tags en Python por cada span:
+
+- start, duration: enteros de 64 bits
+- status, service, operation: identificadores de un diccionario de valores
+- tags: almacén codificado por diccionario (cada valor distinto se guarda y
+  se analiza una sola vez) con, por cada aparición, el span al que pertenece
+
+Solo los spans seleccionados se vuelven a materializar como filas.
+
+Dependencia opcional:
+- numpy: sin él las mismas consultas se resuelven con listas Python.
+"""
+
+from itertools import chain
+from operator import itemgetter
+from typing import Any, Iterable, List, Sequence, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # Opcional: consultas sobre listas
+    np = None
+
+# Columnas de un registro de span (ver otlp_traces.SpanRecord)
+SPAN_ID, SERVICE, OPERATION, START, DURATION, STATUS, TAGS, PARENT_SPAN_ID = range(8)
+
+_NUMERIC_TYPES = {bool, int, float}
+
+
+def _encode(values: Sequence[Any]) -> Tuple[List[Any], List[int]]:
+    """Codificación por diccionario: (valores distintos, identificador de cada valor)"""
+    keys = values
+    if len(set(map(type, values)) & _NUMERIC_TYPES) > 1:
+        # True, 1 y 1.0 son iguales como claves: se distinguen por tipo
+        keys = [value if value.__class__ is str else (value.__class__, value) for value in values]
+    ids = dict.fromkeys(keys)
+    for value_id, key in enumerate(ids):
+        ids[key] = value_id
+    distinct = list(ids) if keys is values else [key if key.__class__ is str else key[1] for key in ids]
+    return distinct, list(map(ids.__getitem__, keys))
+
+
+def _column(values: Sequence[int]):
+    return np.array(values, dtype=np.int64) if np is not None else list(values)
+
+
+class SpanTable:
+    """Spans de varias trazas almacenados por columnas"""
+
+    def __init__(self, traces: Iterable[Tuple[str, Sequence[Sequence[Any]]]]):
+        self.trace_ids: List[str] = []
+        counts: List[int] = []
+        blocks = []
+        for trace_id, records in traces:
+            self.trace_ids.append(trace_id)
+            counts.append(len(records))
+            blocks.append(records)
+
+        self.blocks = blocks
+        self.records = list(chain.from_iterable(blocks))
+        self.size = len(self.records)
+        columns = [list(map(itemgetter(column), self.records)) for column in range(TAGS + 1)]
+
+        self.start = _column(columns[START])
+        self.duration = _column(columns[DURATION])
+        self.statuses, status = _encode(columns[STATUS])
+        self.services, service = _encode(columns[SERVICE])
+        self.operations, operation = _encode(columns[OPERATION])
+        self.status = _column(status)
+        self.service = _column(service)
+        self.operation = _column(operation)
+
+        tags = columns[TAGS]
+        self.tag_values, tag_value = _encode(list(chain.from_iterable(t.values() for t in tags)))
+        self.tag_value = _column(tag_value)
+        tag_counts = [len(t) for t in tags]
+        if np is not None:
+            self.trace = np.repeat(np.arange(len(counts)), counts)
+            self.tag_span = np.repeat(np.arange(self.size), tag_counts)
+        else:
+            self.trace = [i for i, count in enumerate(counts) for _ in range(count)]
+            self.tag_span = [i for i, count in enumerate(tag_counts) for _ in range(count)]
+
+    def __len__(self) -> int:
+        return self.size
+
+    def trace_records(self) -> Iterable[Tuple[str, Sequence[Sequence[Any]]]]:
+        """(trace_id, registros) de cada traza de la tabla"""
+        return zip(self.trace_ids, self.blocks)
+
+    def row(self, i: int) -> Tuple[Any, ...]:
+        """Span i como (trace_id, *registro)"""
+        return (self.trace_ids[self.trace[i]], *self.records[i])
+
+    @staticmethod
+    def _matching(values: List[Any], predicate) -> List[int]:
+        return [value_id for value_id, value in enumerate(values) if predicate(value)]
+
+    def status_in(self, codes: Sequence[str]):
+        """Máscara de los spans cuyo status_code está en codes"""
+        ids = self._matching(self.statuses, lambda status: status in codes)
+        if np is not None:
+            return np.isin(self.status, ids)
+        ids = set(ids)
+        return [status in ids for status in self.status]
+
+    def any_tag_value(self, predicate):
+        """Máscara de los spans con algún tag cuyo valor cumple predicate (evaluado una vez por valor)"""
+        matching = self._matching(self.tag_values, predicate)
+        if np is not None:
+            value_matches = np.zeros(len(self.tag_values), dtype=bool)
+            value_matches[matching] = True
+            mask = np.zeros(self.size, dtype=bool)
+            mask[self.tag_span[value_matches[self.tag_value]]] = True
+            return mask
+        matching = set(matching)
+        mask = [False] * self.size
+        for span, value in zip(self.tag_span, self.tag_value):
+            if value in matching:
+                mask[span] = True
+        return mask
+
+    @staticmethod
+    def any_of(*masks):
+        """Unión de varias máscaras"""
+        if np is not None:
+            return np.logical_or.reduce(masks)
+        return [any(flags) for flags in zip(*masks)]
+
+    @staticmethod
+    def indices(mask) -> List[int]:
+        """Posiciones de los spans seleccionados por una máscara, en orden"""
+        if np is not None:
+            return np.flatnonzero(mask).tolist()
+        return [i for i, selected in enumerate(mask) if selected]
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Árbol de Spans y Ruta Crítica
+=============================
+
+Reconstruye el árbol padre/hijo de una traza a partir de sus spans en
+tiempo lineal (un índice por span_id) y calcula:
+
+- self-time: tiempo del span no cubierto por ninguno de sus hijos
+- ruta crítica: la cadena de spans que determina la duración total,
+  recorriendo desde el final de cada span hacia atrás el hijo que termina
+  más tarde; cada span aporta los tramos en los que está en la ruta sin
+  que ningún hijo lo esté
+
+Todo es iterativo, así que trazas de pipelines con miles de spans (y
+anidamiento profundo) no dependen del límite de recursión.
+"""
+
+from collections import defaultdict
+from typing import Any, Dict, List, Sequence, Tuple
+
+from span_table import DURATION, OPERATION, PARENT_SPAN_ID, SERVICE, SPAN_ID, START
+
+# (servicio, operación)
+OperationKey = Tuple[str, str]
+
+
+class SpanTree:
+    """Árbol de spans de una traza (registros de span, ver otlp_traces.SpanRecord)"""
+
+    def __init__(self, records: Sequence[Sequence[Any]]):
+        self.records = records
+        self.start = [int(record[START]) for record in records]
+        self.end = [start + int(record[DURATION]) for start, record in zip(self.start, records)]
+        self.children: List[List[int]] = [[] for _ in records]
+        self.roots: List[int] = []
+
+        index = {record[SPAN_ID]: i for i, record in enumerate(records)}
+        for i, record in enumerate(records):
+            parent = index.get(record[PARENT_SPAN_ID]) if len(record) > PARENT_SPAN_ID else None
+            if parent is None or parent == i:
+                self.roots.append(i)  # Sin padre, o con el padre fuera de la traza descargada
+            else:
+                self.children[parent].append(i)
+
+    def self_times(self) -> List[int]:
+        """Tiempo propio de cada span: su duración menos la unión de los intervalos de sus hijos"""
+        self_times = []
+        for i, children in enumerate(self.children):
+            start, end = self.start[i], self.end[i]
+            covered = 0
+            cursor = start
+            for child_start, child_end in sorted((self.start[c], self.end[c]) for c in children):
+                child_start, child_end = max(child_start, cursor), min(child_end, end)
+                if child_end > child_start:
+                    covered += child_end - child_start
+                    cursor = child_end
+            self_times.append(end - start - covered)
+        return self_times
+
+    def critical_path(self) -> Dict[int, int]:
+        """Aportación (ns) de cada span a la ruta crítica de la raíz que termina más tarde"""
+        contributions: Dict[int, int] = defaultdict(int)
+        if not self.roots:
+            return contributions
+
+        root = max(self.roots, key=lambda i: self.end[i])
+        stack = [(root, self.end[root])]
+        while stack:
+            span, window_end = stack.pop()
+            span_start = self.start[span]
+            cursor = min(self.end[span], window_end)
+
+            # Hacia atrás desde el final: en cada paso, el hijo que termina más tarde antes del cursor
+            for child in sorted(self.children[span], key=lambda c: self.end[c], reverse=True):
+                if cursor <= span_start:
+                    break
+                if self.start[child] >= cursor:
+                    continue  # Empieza después del cursor: no está en la ruta
+                child_end = min(self.end[child], cursor)
+                if child_end <= span_start:
+                    break  # Los siguientes terminan aún antes
+                contributions[span] += cursor - child_end
+                stack.append((child, child_end))
+                cursor = max(self.start[child], span_start)
+
+            if cursor > span_start:
+                contributions[span] += cursor - span_start
+
+        return contributions
+
+
+def rank_latency_drivers(traces: Sequence[Tuple[str, Sequence[Sequence[Any]]]]) -> Tuple[List[Dict[str, Any]], Dict[str, List[Tuple[OperationKey, int]]]]:
+    """Operaciones ordenadas por su tiempo total en la ruta crítica, y la ruta de cada traza
+
+    Devuelve (ranking, rutas): el ranking tiene por operación el tiempo en ruta crítica,
+    el self-time y en cuántas trazas aparece en la ruta; las rutas, por trace_id, las
+    operaciones de la ruta crítica con su aportación, de mayor a menor.
+    """
+    critical: Dict[OperationKey, int] = defaultdict(int)
+    self_time: Dict[OperationKey, int] = defaultdict(int)
+    trace_count: Dict[OperationKey, int] = defaultdict(int)
+    paths: Dict[str, List[Tuple[OperationKey, int]]] = {}
+    total = 0
+
+    for trace_id, records in traces:
+        if not records:
+            continue
+        tree = SpanTree(records)
+        keys = [(record[SERVICE], record[OPERATION]) for record in records]
+
+        for key, span_self_time in zip(keys, tree.self_times()):
+            self_time[key] += span_self_time
+
+        path: Dict[OperationKey, int] = defaultdict(int)
+        for span, contribution in tree.critical_path().items():
+            path[keys[span]] += contribution
+        for key, contribution in path.items():
+            critical[key] += contribution
+            trace_count[key] += 1
+            total += contribution
+        paths[trace_id] = sorted(path.items(), key=lambda item: item[1], reverse=True)
+
+    ranking = [
+        {
+            'service': service,
+            'operation': operation,
+            'critical_path_ns': critical[(service, operation)],
+            'critical_path_share': critical[(service, operation)] / total if total else 0.0,
+            'self_time_ns': self_time[(service, operation)],
+            'traces': trace_count[(service, operation)]
+        }
+        for service, operation in sorted(critical, key=critical.get, reverse=True)
+    ]
+    return ranking, paths
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Caché de Trazas de Tempo
+========================
+
+Las trazas completas de Tempo no cambian, así que cada ejecución horaria
+solo necesita descargar las trazas nuevas. Esta caché combina:
+
+- una LRU en memoria para las trazas usadas en la ejecución actual
+- un almacén en disco comprimido con zlib (un fichero por traza) que
+  persiste entre ejecuciones, con expulsión por tamaño total (las menos
+  usadas primero)
+- "single-flight": si varias peticiones piden la misma traza a la vez,
+  solo una la descarga y las demás esperan su resultado
+"""
+
+import asyncio
+import json
+import logging
+import os
+import re
+import zlib
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+_SAFE_KEY = re.compile(r'[^0-9A-Za-z_-]')
+
+
+class TraceCache:
+    """LRU en memoria respaldada por un almacén comprimido en disco"""
+
+    def __init__(self, directory: str = ".trace_cache", memory_entries: int = 256,
+                 max_disk_bytes: int = 256 * 1024 * 1024):
+        self.directory = directory
+        self.memory_entries = memory_entries
+        self.max_disk_bytes = max_disk_bytes
+
+        self._memory: "OrderedDict[str, Any]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(self.directory, exist_ok=True)
+        self._disk_bytes = sum(
+            entry.stat().st_size for entry in os.scandir(self.directory) if entry.name.endswith('.json.z')
+        )
+
+    @classmethod
+    def from_env(cls) -> Optional["TraceCache"]:
+        """Caché configurada con TRACE_CACHE_*; None si está desactivada"""
+        if os.getenv("TRACE_CACHE_ENABLED", "true").lower() != "true":
+            return None
+        return cls(
+            directory=os.getenv("TRACE_CACHE_DIR", ".trace_cache"),
+            memory_entries=int(os.getenv("TRACE_CACHE_MEMORY_ENTRIES", 256)),
+            max_disk_bytes=int(float(os.getenv("TRACE_CACHE_MAX_MB", 256)) * 1024 * 1024)
+        )
+
+    def _path(self, trace_id: str) -> str:
+        return os.path.join(self.directory, _SAFE_KEY.sub('_', trace_id) + '.json.z')
+
+    def get(self, trace_id: str) -> Optional[Any]:
+        """Traza en caché (memoria o disco), o None"""
+        if trace_id in self._memory:
+            self._memory.move_to_end(trace_id)
+            self.hits += 1
+            return self._memory[trace_id]
+
+        path = self._path(trace_id)
+        try:
+            with open(path, 'rb') as f:
+                value = json.loads(zlib.decompress(f.read()))
+            os.utime(path)  # Marca de uso para la expulsión LRU en disco
+        except (OSError, ValueError, zlib.error):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._remember(trace_id, value)
+        return value
+
+    def put(self, trace_id: str, value: Any) -> None:
+        """Guarda una traza en memoria y en disco"""
+        data = zlib.compress(json.dumps(value, separators=(',', ':')).encode('utf-8'))
+
+        self._remember(trace_id, value)
+
+        path = self._path(trace_id)
+        try:
+            previous = os.path.getsize(path) if os.path.exists(path) else 0
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            self._disk_bytes += len(data) - previous
+        except OSError as e:
+            logger.warning(f"No se pudo guardar la traza {trace_id} en disco: {e}")
+            return
+
+        if self._disk_bytes > self.max_disk_bytes:
+            self._evict_disk()
+
+    def _remember(self, trace_id: str, value: Any) -> None:
+        self._memory[trace_id] = value
+        self._memory.move_to_end(trace_id)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _evict_disk(self) -> None:
+        """Borra las trazas usadas hace más tiempo hasta bajar del 90% del límite"""
+        entries = sorted(
+            (entry for entry in os.scandir(self.directory) if entry.name.endswith('.json.z')),
+            key=lambda entry: entry.stat().st_mtime
+        )
+        target = self.max_disk_bytes * 0.9
+
+        for entry in entries:
+            if self._disk_bytes <= target:
+                break
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+                self._disk_bytes -= size
+            except OSError:
+                continue
+
+    async def get_or_fetch_async(self, trace_id: str, fetch: Callable[[], Awaitable[Optional[Any]]],
+                                 cacheable: Callable[[Any], bool] = lambda value: True) -> Optional[Any]:
+        """Traza en caché o descargada con fetch(); una sola descarga por traza entre corrutinas"""
+        value = self.get(trace_id)
+        if value is not None:
+            return value
+
+        future = self._inflight.get(trace_id)
+        if future is not None:
+            return await asyncio.shield(future)
+
+        future = self._inflight[trace_id] = asyncio.get_running_loop().create_future()
+        try:
+            value = await fetch()
+            if value is not None and cacheable(value):
+                self.put(trace_id, value)
+            future.set_result(value)
+            return value
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # Recuperada: sin avisos si nadie más esperaba
+            raise
+        finally:
+            self._inflight.pop(trace_id, None)
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Índice de Logs por Trace ID
+===========================
+
+Extrae los identificadores de traza y span que aparecen en las líneas de
+log y construye un índice en memoria, para unir logs y spans por
+identificador exacto en una sola pasada sobre una descarga masiva de logs,
+en lugar de por ventana de tiempo o con una consulta `|= "<trace_id>"` por
+traza.
+
+Formatos reconocidos:
+- W3C traceparent: `00-<trace_id 32 hex>-<span_id 16 hex>-<flags>`
+- clave=valor: `traceID=...`, `trace_id=...`, `spanId=...`
+- campos JSON: `"trace_id": "..."`, `"traceId": "..."`, `"span_id": "..."`
+- labels: tras `| json` en LogQL los campos JSON pasan a ser labels del stream
+  (`trace_id`, `traceId`, `span_id`...) y desaparecen de la línea reformateada
+
+Los identificadores se normalizan (minúsculas, sin ceros a la izquierda)
+porque Tempo y los distintos SDK no siempre los rellenan igual.
+"""
+
+import re
+from collections import defaultdict
+from operator import itemgetter
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+_TRACEPARENT = re.compile(r'\b[0-9a-f]{2}-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}\b', re.IGNORECASE)
+_TRACE_FIELD = re.compile(r'trace[_.-]?id["\']?\s*[:=]\s*["\']?([0-9a-f]{1,32})\b', re.IGNORECASE)
+_SPAN_FIELD = re.compile(r'span[_.-]?id["\']?\s*[:=]\s*["\']?([0-9a-f]{1,16})\b', re.IGNORECASE)
+_TRACE_LABEL = re.compile(r'trace[_.-]?id', re.IGNORECASE)
+_SPAN_LABEL = re.compile(r'span[_.-]?id', re.IGNORECASE)
+_TRACE_VALUE = re.compile(r'[0-9a-f]{1,32}', re.IGNORECASE)
+_SPAN_VALUE = re.compile(r'[0-9a-f]{1,16}', re.IGNORECASE)
+
+
+def normalize_id(value: str) -> str:
+    """Clave de comparación de un trace o span ID"""
+    return value.lower().lstrip('0') or '0'
+
+
+def extract_trace_context(line: str) -> Optional[Tuple[str, Optional[str]]]:
+    """(trace_id, span_id o None) normalizados de una línea de log, o None si no tiene trace ID"""
+    match = _TRACEPARENT.search(line)
+    if match:
+        return normalize_id(match.group(1)), normalize_id(match.group(2))
+
+    match = _TRACE_FIELD.search(line)
+    if match is None:
+        return None
+    span = _SPAN_FIELD.search(line)
+    return normalize_id(match.group(1)), normalize_id(span.group(1)) if span else None
+
+
+def extract_label_context(labels: Dict[str, str]) -> Optional[Tuple[str, Optional[str]]]:
+    """(trace_id, span_id o None) normalizados de los labels de un log, o None si no tiene trace ID"""
+    trace_id = span_id = None
+    for key, value in labels.items():
+        if key == 'traceparent':
+            match = _TRACEPARENT.fullmatch(value)
+            if match:
+                return normalize_id(match.group(1)), normalize_id(match.group(2))
+        elif trace_id is None and _TRACE_LABEL.fullmatch(key) and _TRACE_VALUE.fullmatch(value):
+            trace_id = normalize_id(value)
+        elif span_id is None and _SPAN_LABEL.fullmatch(key) and _SPAN_VALUE.fullmatch(value):
+            span_id = normalize_id(value)
+    return (trace_id, span_id) if trace_id is not None else None
+
+
+class TraceLogIndex:
+    """Logs agrupados por trace ID y por (trace ID, span ID)"""
+
+    def __init__(self, logs: Iterable[Any], line: Callable[[Any], str] = itemgetter('line'),
+                 labels: Optional[Callable[[Any], Dict[str, str]]] = None):
+        self.by_trace: Dict[str, List[Any]] = defaultdict(list)
+        self.by_span: Dict[Tuple[str, str], List[Any]] = defaultdict(list)
+        self.scanned = 0
+
+        for log in logs:
+            self.scanned += 1
+            context = extract_label_context(labels(log)) if labels is not None else None
+            if context is None:
+                context = extract_trace_context(line(log))
+            if context is None:
+                continue
+            trace_id, span_id = context
+            self.by_trace[trace_id].append(log)
+            if span_id is not None:
+                self.by_span[(trace_id, span_id)].append(log)
+
+    @property
+    def indexed(self) -> int:
+        """Logs con trace ID"""
+        return sum(len(logs) for logs in self.by_trace.values())
+
+    def for_trace(self, trace_id: str) -> List[Any]:
+        return self.by_trace.get(normalize_id(trace_id), [])
+
+    def for_span(self, trace_id: str, span_id: str) -> List[Any]:
+        return self.by_span.get((normalize_id(trace_id), normalize_id(span_id)), [])